@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+#
+# This file is part of encyc-front
+#
+
+description = """benchmark - Micro-benchmarks for encyc-front hot paths."""
+
+epilog = """
+Each subcommand times one piece of encyc-front against the implementation
+it replaced and prints throughput and output size.
+
+    $ cd /usr/local/src/encyc-front/front
+    $ python bin/benchmark.py prepare
+    $ python bin/benchmark.py prepare --rounds 500
+
+prepare
+    Internal-link rewriting of article bodies (Page.prepare_body):
+    wikiprox.links.rewrite_links vs the BeautifulSoup + prettify() version.
+    Input is the long articles in wikiprox/sample_data.py, with their
+    internal MediaWiki links marked up the way encyc-core publishes them.
+    The old version needs beautifulsoup4, which encyc-front no longer
+    depends on:  pip install beautifulsoup4
+
+categories
+    Grouping pages by category (Page.pages_by_category):
+    wikiprox.corpus.by_category vs the list-membership version, on
+    synthetic corpora.  The old version is quadratic so by default it is
+    only run for corpora of up to 20000 pages.
+
+    $ python bin/benchmark.py categories --pages 10000 50000 100000
+
+events
+    Timeline events cache hits (events.backend.events): the JSON string
+    + strptime version vs parsed records keyed by content hash, in a
+    process that has already seen them (warm) and one that has not
+    (cold, records come out of the cache).  Uses synthetic PSMS events
+    and Django's local-memory cache.
+
+    $ python bin/benchmark.py events --events 1000
+
+startup
+    Time for a fresh process to run django.setup(), which imports
+    wikiprox.models, using the configured Elasticsearch host and then
+    hosts that are slow or unreachable.  Requires the usual
+    /etc/encyc/front.cfg.
+
+    $ python bin/benchmark.py startup --hosts 10.255.255.1:9200
+"""
+
+import argparse
+from datetime import datetime
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import timeit
+
+# so we can import wikiprox etc
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def logprint(msg):
+    if msg.strip():
+        print('%s %s' % (datetime.now(), msg.strip()))
+
+def report(label, seconds, rounds, nbytes, size):
+    """Print throughput for one implementation
+
+    @param label: str
+    @param seconds: float Total time for all rounds
+    @param rounds: int
+    @param nbytes: int Input size (per round)
+    @param size: int Output size (per round)
+    """
+    per_round = seconds / rounds
+    logprint('%-12s %8.3f ms/round  %8.1f MB/s  output %s bytes' % (
+        label,
+        per_round * 1000,
+        nbytes / per_round / 1024 / 1024,
+        size,
+    ))
+
+
+# prepare --------------------------------------------------------------
+
+def prepare_soup(body):
+    """The original Page.prepare() link rewriter, kept as the baseline
+    """
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(body, 'html.parser')
+    for a in soup.find_all('a', class_='encyc'):
+        a['href'] = a['href'].replace('/wiki', '')
+        if a['href'][-1] != '/':
+            a['href'] += '/'
+    return soup.prettify()
+
+def sample_bodies():
+    """Article bodies from wikiprox.sample_data, as encyc-core publishes them
+
+    encyc-core marks internal links with class="encyc" and "/wiki/TITLE".
+    """
+    from wikiprox import sample_data
+    bodies = []
+    for name in dir(sample_data):
+        data = getattr(sample_data, name)
+        if isinstance(data, dict) and data.get('parse'):
+            html = data['parse']['text']['*']
+            html = re.sub(
+                r'<a href="/mediawiki/index.php/(?!File:)',
+                '<a class="encyc" href="/wiki/',
+                html
+            )
+            bodies.append(html)
+    return bodies
+
+def link_hrefs(html):
+    from bs4 import BeautifulSoup
+    return [a.get('href') for a in BeautifulSoup(html, 'html.parser').find_all('a')]
+
+def bench_prepare(args):
+    from wikiprox import links
+    bodies = sample_bodies()
+    nbytes = sum(len(body) for body in bodies)
+    logprint('%s bodies, %s bytes, %s rounds' % (len(bodies), nbytes, args.rounds))
+    # outputs must link to the same places
+    for body in bodies:
+        assert link_hrefs(links.rewrite_links(body)) == link_hrefs(prepare_soup(body))
+    for label,func in [
+            ('soup', prepare_soup),
+            ('rewrite', links.rewrite_links),
+    ]:
+        seconds = timeit.timeit(
+            lambda: [func(body) for body in bodies], number=args.rounds
+        )
+        size = sum(len(func(body)) for body in bodies)
+        report(label, seconds, args.rounds, nbytes, size)
+
+
+# categories -----------------------------------------------------------
+
+class SyntheticPage():
+    """Just enough of a light Page for grouping by category
+    """
+    def __init__(self, n, categories):
+        self.title = 'Article %06d' % n
+        self.url_title = self.title
+        self.title_sort = self.title.lower()
+        self.categories = categories
+
+    def __eq__(self, other):
+        return self.title_sort == other.title_sort
+
+    def __lt__(self, other):
+        return self.title_sort < other.title_sort
+
+    def absolute_url(self):
+        return '/%s' % self.title
+
+def synthetic_pages(num_pages, num_categories=40, hidden=['CAL60', 'In_Camp']):
+    """Sorted pages with 1-4 categories each, some of them hidden/repeated
+    """
+    rand = random.Random(num_pages)
+    names = ['Category%02d' % n for n in range(num_categories)] + hidden
+    return sorted([
+        SyntheticPage(n, [rand.choice(names) for _ in range(rand.randint(1, 4))])
+        for n in range(num_pages)
+    ])
+
+def by_category_old(pages, hidden_categories):
+    """The original Page.pages_by_category() grouping, kept as the baseline
+    """
+    from wikiprox.corpus import page_dict
+    categories = {}
+    for page in pages:
+        for category in page.categories:
+            if category not in hidden_categories:
+                if category not in categories.keys():
+                    categories[category] = []
+                if page not in categories[category]:
+                    categories[category].append(page)
+    categories_list = [
+        (key,categories[key])
+        for key in sorted(categories.keys())
+    ]
+    data = []
+    while(categories_list):
+        key,pages = categories_list.pop(0)
+        data.append((key, [page_dict(page) for page in pages]))
+    return data
+
+def bench_categories(args):
+    from wikiprox import corpus
+    hidden = ('CAL60', 'In_Camp')
+    for num_pages in args.pages:
+        pages = synthetic_pages(num_pages)
+        logprint('%s pages' % num_pages)
+        implementations = [('by_category', corpus.by_category)]
+        if num_pages <= args.baseline_max:
+            implementations.insert(0, ('old', by_category_old))
+        results = []
+        for label,func in implementations:
+            seconds = timeit.timeit(lambda: func(pages, hidden), number=args.rounds)
+            results.append(func(pages, hidden))
+            logprint('%-12s %10.1f ms/build  %10.0f pages/s' % (
+                label,
+                seconds / args.rounds * 1000,
+                num_pages * args.rounds / seconds,
+            ))
+        # outputs must be identical
+        assert all(result == results[0] for result in results)
+
+
+# events ---------------------------------------------------------------
+
+def psms_payload(num_events):
+    """PSMS /events/ API response with num_events events
+    """
+    rand = random.Random(num_events)
+    objects = []
+    for n in range(num_events):
+        year = rand.randint(1790, 2000)
+        obj = {
+            'id': n,
+            'published': True,
+            'title': 'Event %s' % n,
+            'description': 'Lorem ipsum dolor sit amet. ' * rand.randint(2, 20),
+            'start_date': '%s-%02d-%02d' % (year, rand.randint(1, 12), rand.randint(1, 28)),
+            'end_date': None,
+            'url': 'https://encyclopedia.densho.org/Article_%s/' % n,
+            'resource_uri': '/api/v1.0/events/%s/' % n,
+        }
+        if rand.random() < 0.3:
+            obj['end_date'] = '%s-12-31' % year
+        objects.append(obj)
+    return json.dumps({'objects': objects}).encode('utf-8')
+
+def events_old(cache, cache_key):
+    """The original events.backend.events() cache hit, kept as the baseline
+    """
+    objects = json.loads(cache.get(cache_key))
+    for obj in objects:
+        if obj.get('start_date',None):
+            obj['start_date'] = datetime.strptime(obj['start_date'], '%Y-%m-%d')
+        if obj.get('end_date',None):
+            obj['end_date'] = datetime.strptime(obj['end_date'], '%Y-%m-%d')
+    return objects
+
+def bench_events(args):
+    from django.conf import settings
+    if not settings.configured:
+        settings.configure(
+            CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            }},
+            CACHE_TIMEOUT=60 * 5,
+        )
+    from django.core.cache import cache
+    from events import backend
+    for num_events in args.events:
+        payload = psms_payload(num_events)
+        logprint('%s events, %s bytes' % (num_events, len(payload)))
+        cache.set('events-old', json.dumps(json.loads(payload)['objects']))
+        records = sorted(backend.parse(payload), key=backend.start_key)
+        backend.load = lambda: records
+        backend.refresh()
+        def events_cold():
+            backend._current = (None, None)
+            return backend.events()
+        # outputs must be identical
+        assert sorted(events_old(cache, 'events-old'), key=backend.start_key) \
+            == events_cold() == backend.events()
+        for label,func in [
+                ('old', lambda: events_old(cache, 'events-old')),
+                ('cold', events_cold),
+                ('warm', backend.events),
+        ]:
+            seconds = timeit.timeit(func, number=args.rounds)
+            logprint('%-12s %10.3f ms/hit' % (label, seconds / args.rounds * 1000))
+
+
+# startup --------------------------------------------------------------
+
+STARTUP_SCRIPT = """
+import os, sys, time
+sys.path.insert(0, %r)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'front.settings')
+from django.conf import settings
+if %r:
+    settings.DOCSTORE_HOST = %r
+started = time.perf_counter()
+import django
+django.setup()
+import wikiprox.models
+print(time.perf_counter() - started)
+"""
+
+def bench_startup(args):
+    front_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for host in [None] + args.hosts:
+        script = STARTUP_SCRIPT % (front_dir, host, host)
+        times = []
+        for _ in range(args.rounds):
+            out = subprocess.check_output([sys.executable, '-c', script])
+            times.append(float(out.decode().strip().splitlines()[-1]))
+        logprint('%-24s min %7.3fs  mean %7.3fs  max %7.3fs' % (
+            host or 'configured host',
+            min(times), sum(times) / len(times), max(times),
+        ))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description=description,
+        epilog=epilog,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+    prepare = subparsers.add_parser('prepare', help='Article body link rewriting')
+    prepare.add_argument('-r', '--rounds', type=int, default=100)
+    prepare.set_defaults(func=bench_prepare)
+    categories = subparsers.add_parser('categories', help='Grouping pages by category')
+    categories.add_argument('-p', '--pages', type=int, nargs='+', default=[10000, 100000])
+    categories.add_argument('-r', '--rounds', type=int, default=3)
+    categories.add_argument(
+        '-b', '--baseline-max', type=int, default=20000,
+        help='Largest corpus to run the old (quadratic) version on.'
+    )
+    categories.set_defaults(func=bench_categories)
+    events = subparsers.add_parser('events', help='Timeline events cache hits')
+    events.add_argument('-e', '--events', type=int, nargs='+', default=[1000])
+    events.add_argument('-r', '--rounds', type=int, default=100)
+    events.set_defaults(func=bench_events)
+    startup = subparsers.add_parser('startup', help='Process start (django.setup) time')
+    startup.add_argument(
+        '-H', '--hosts', nargs='*', default=['10.255.255.1:9200'],
+        help='Other DOCSTORE_HOSTs to try (default: an unroutable address).'
+    )
+    startup.add_argument('-r', '--rounds', type=int, default=5)
+    startup.set_defaults(func=bench_startup)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,55 @@
+import logging
+logger = logging.getLogger(__name__)
+
+from elasticsearch.exceptions import TransportError
 import requests
 
 from django.conf import settings
+from django.utils.dateparse import parse_date
 
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 
 from events import backend as ev
+from wikiprox import pagination
 
 
 @api_view(['GET'])
 def events(request, format=None):
-    """DOCUMENTATION GOES HERE.
+    """Timeline events, by start_date.
+
+    Filters (all optional):
+    - start, end: YYYY-MM-DD Events starting on or between these dates.
+    - article_title: Events linked to this encyclopedia article.
+
+    Paginated with ?limit=&offset= or ?limit=&cursor=; without either
+    all matching events are returned.
     """
     try:
-        data = ev.events()
+        start = _date(request.query_params.get('start'))
+        end = _date(request.query_params.get('end'))
+    except ValueError:
+        return Response(status=status.HTTP_400_BAD_REQUEST)
+    try:
+        index = ev.events_index()
     except requests.exceptions.Timeout:
         return Response(status=status.HTTP_408_REQUEST_TIMEOUT)
-    return Response(data)
+    except TransportError as err:
+        logger.error('Could not load events: %s' % err)
+        return Response(status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    objects,sort_keys = index.select(
+        start=start, end=end,
+        article_title=request.query_params.get('article_title'),
+    )
+    return pagination.respond(request, objects, sort_keys, lambda obj: obj)
+
+def _date(text):
+    """date from YYYY-MM-DD, or None
+    """
+    if not text:
+        return None
+    value = parse_date(text)
+    if not value:
+        raise ValueError('Not a date: %s' % text)
+    return value
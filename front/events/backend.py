@@ -1,33 +1,208 @@
-from datetime import datetime
+from bisect import bisect_left, bisect_right
+from datetime import datetime, time
+import hashlib
 import json
+import logging
+logger = logging.getLogger(__name__)
 
+from elasticsearch.exceptions import NotFoundError
 import requests
 
 from django.conf import settings
 from django.core.cache import cache
 
+from events.models import Event
 from wikiprox import make_cache_key
+from wikiprox import pagecache
+from wikiprox import timing
+
+# hash of the current events, refreshed every CACHE_TIMEOUT
+EVENTS_HASH_KEY = make_cache_key('encyc-front:events:hash')
+# events for a hash
+EVENTS_RECORDS_KEY = 'encyc-front:events:records:%s'
+EVENTS_RECORDS_TIMEOUT = 60 * 60 * 24
+
+# (hash, EventIndex) last used in this process
+_current = (None, None)
+
+
+class EventIndex():
+    """Events sorted by start_date, with lookups by date and article
+
+    Lookups cost O(log n) plus the number of events returned.
+    """
+    objects = []
+    keys = []
+    cursor_keys = []
+    by_article = {}
+
+    def __init__(self, objects):
+        """
+        @param objects: list of event dicts, sorted by start_date
+        """
+        self.objects = objects
+        self.keys = [start_key(obj) for obj in objects]
+        # JSON-able sort keys for API cursors
+        self.cursor_keys = [key.isoformat() for key in self.keys]
+        # article_title: (objects, keys, cursor_keys)
+        self.by_article = {}
+        for n,obj in enumerate(objects):
+            if obj.get('article_title'):
+                lists = self.by_article.setdefault(obj['article_title'], ([], [], []))
+                lists[0].append(obj)
+                lists[1].append(self.keys[n])
+                lists[2].append(self.cursor_keys[n])
+
+    def filter(self, start=None, end=None, article_title=None):
+        """Events starting between start and end (inclusive)
+
+        @param start: date
+        @param end: date
+        @param article_title: str Only events linked to this article
+        @returns: list of event dicts, sorted by start_date
+        """
+        return self.select(start, end, article_title)[0]
+
+    def select(self, start=None, end=None, article_title=None):
+        """Like filter(), plus the matching slice of cursor_keys
+
+        @param start: date
+        @param end: date
+        @param article_title: str Only events linked to this article
+        @returns: (list of event dicts, list of str)
+        """
+        objects,keys,cursor_keys = self.objects,self.keys,self.cursor_keys
+        if article_title:
+            objects,keys,cursor_keys = self.by_article.get(
+                article_title, ([], [], [])
+            )
+        lo = 0
+        hi = len(objects)
+        if start:
+            lo = bisect_left(keys, datetime.combine(start, time.min))
+        if end:
+            hi = bisect_right(keys, datetime.combine(end, time.max))
+        return objects[lo:hi],cursor_keys[lo:hi]
+
+def start_key(obj):
+    # events without a start_date sort last, as in the events index
+    return obj.get('start_date') or datetime.max
 
 
 def events():
-    """Returns list of events and a status message.
+    """Returns list of events.
+
+    Events are dicts like those returned by the PSMS API, with
+    start_date and end_date as datetimes, sorted by start_date.  They
+    come from the events index (see load()) and are kept in the cache
+    keyed by a hash of their contents; on a cache hit the list from the
+    last request in this process is reused, so no parsing or
+    deserializing is done.
+
+    IMPORTANT: the list is shared between requests.  Do not modify it.
+
+    @returns: list of dicts
+    """
+    return events_index().objects
+
+@timing.timed('events')
+def events_index():
+    """Returns EventIndex of the current events (see events()).
+
+    @returns: EventIndex
+    """
+    global _current
+    content_hash = cache.get(EVENTS_HASH_KEY)
+    current = _current
+    if content_hash and (content_hash == current[0]):
+        return current[1]
+    objects = None
+    if content_hash:
+        objects = cache.get(_records_key(content_hash))
+    if objects is None:
+        content_hash,objects = refresh()
+    index = EventIndex(objects)
+    _current = (content_hash, index)
+    return index
+
+def _records_key(content_hash):
+    return make_cache_key(EVENTS_RECORDS_KEY % content_hash)
+
+def refresh():
+    """Load events and cache them
+
+    Purges cached renders of the events page when the events change.
+
+    @returns: (str hash, list of events)
+    """
+    objects = load()
+    content_hash = hashlib.sha1(
+        json.dumps(objects, sort_keys=True, default=str).encode('utf-8')
+    ).hexdigest()
+    records_key = _records_key(content_hash)
+    if cache.get(records_key) is None:
+        cache.set(records_key, objects, EVENTS_RECORDS_TIMEOUT)
+    cache.set(EVENTS_HASH_KEY, content_hash, settings.CACHE_TIMEOUT)
+    pagecache.purge_modified('events', {'events': content_hash})
+    return content_hash,objects
+
+def load():
+    """Events from the events index, or from PSMS if there is no index yet
+
+    The index is loaded from PSMS by `manage.py load_events`.
+
+    @returns: list of dicts
+    """
+    try:
+        return [event_dict(event) for event in Event.events()]
+    except NotFoundError:
+        logger.warning('No events index, using PSMS. Run manage.py load_events.')
+        return sorted(parse(fetch_psms()), key=start_key)
+
+def event_dict(event):
+    """Event as a dict, as used by the timeline and API
+
+    @param event: events.models.Event
+    @returns: dict
+    """
+    return {
+        'id': int(event.meta.id),
+        'published': event.published,
+        'title': event.title,
+        'description': event.description,
+        'start_date': event.start_date,
+        'end_date': event.end_date,
+        'article_title': event.article_title,
+        'url': event.url,
+        'resource_uri': event.resource_uri,
+    }
+
+def fetch_psms():
+    """Raw events payload from the PSMS API, or b'' if not available
+
+    @returns: bytes
+    @raises: requests.exceptions.Timeout
+    """
+    url = '%s/events/' % settings.SOURCES_API
+    r = requests.get(
+        url, params={'limit':1000},
+        headers={'content-type':'application/json'},
+        timeout=3)
+    if r and r.status_code == 200:
+        return r.content
+    return b''
+
+def parse(content):
+    """List of events from a PSMS events payload
+
+    @param content: bytes
+    @returns: list of dicts
     """
     objects = []
-    cache_key = make_cache_key('wikiprox:events:events')
-    cached = cache.get(cache_key)
-    if cached:
-        objects = json.loads(cached)
-    else:
-        url = '%s/events/' % settings.SOURCES_API
-        r = requests.get(
-            url, params={'limit':1000},
-            headers={'content-type':'application/json'},
-            timeout=3)
-        if r and r.status_code == 200:
-            response = json.loads(r.text)
-            for obj in response['objects']:
-                objects.append(obj)
-        cache.set(cache_key, json.dumps(objects), settings.CACHE_TIMEOUT)
+    if content:
+        response = json.loads(content)
+        for obj in response['objects']:
+            objects.append(obj)
     # convert all the dates
     for obj in objects:
         if obj.get('start_date',None):
@@ -0,0 +1,24 @@
+import requests
+
+from django.core.management.base import BaseCommand, CommandError
+
+from events import backend
+from events.models import Event
+
+
+class Command(BaseCommand):
+    help = 'Load timeline events from encyc-psms into the events index.'
+
+    def handle(self, *args, **options):
+        try:
+            events = Event.from_psms()
+        except (requests.exceptions.Timeout,
+                requests.exceptions.ConnectionError) as err:
+            raise CommandError('Could not get events from PSMS: %s' % err)
+        if not events:
+            # don't empty the index because PSMS is down
+            raise CommandError('No events from PSMS. Index not changed.')
+        num = Event.index_events(events)
+        # update the timeline now rather than in CACHE_TIMEOUT
+        backend.refresh()
+        self.stdout.write('%s events indexed' % num)
@@ -2,15 +2,15 @@ from datetime import datetime
 import json
 import logging
 logger = logging.getLogger(__name__)
-from urllib.parse import urlparse
+from urllib.parse import unquote, urlparse
 
-from elasticsearch.exceptions import NotFoundError
+from elasticsearch import helpers
 import elasticsearch_dsl as dsl
 import requests
 
 from django.conf import settings
-from django.db import models
-from django.urls import reverse
+
+from wikiprox.models import DOCSTORE
 
 MAX_SIZE = 10000
 
@@ -27,6 +27,20 @@ def hitvalue(hit, field):
     return value
 
 
+def article_title(url):
+    """Encyclopedia article title from an event's URL
+    
+    >>> article_title('https://encyclopedia.densho.org/Executive_Order_9066/')
+    'Executive Order 9066'
+    
+    @param url: str or None
+    @returns: str
+    """
+    if not url:
+        return ''
+    return unquote(urlparse(url).path).strip('/').replace('_', ' ')
+
+
 class Event(dsl.Document):
     """
     IMPORTANT: uses Elasticsearch-DSL, not the Django ORM.
@@ -38,6 +52,7 @@ class Event(dsl.Document):
     start_date = dsl.Date()
     end_date = dsl.Date()
     article_title = dsl.Keyword()
+    url = dsl.Keyword()
     resource_uri = dsl.Keyword()
     
     class Index:
@@ -79,38 +94,57 @@ class Event(dsl.Document):
     #    return reverse('url title', args=([self.id,]))
 
     @staticmethod
-    def events():
-        """Returns list of Event objects.
+    def events(start=None, end=None, article_title=None):
+        """Returns list of Event objects from the events index, by start_date.
         
+        Load the index with `manage.py load_events`.
+        
+        @param start: date or datetime Only events starting on or after
+        @param end: date or datetime Only events starting on or before
+        @param article_title: str Only events linked to this article
         @returns: list
+        @raises: NotFoundError if the index does not exist
         """
-        s = Search(doc_type='events')[0:MAX_SIZE]
-        s = s.sort('start_date')
-        s = s.fields([
-            'id',
-            'published',
-            'title',
-            'description',
-            'start_date',
-            'end_date',
-            'article_title',
-            'resource_uri',
+        ds = DOCSTORE
+        s = Event.search(using=ds.es, index=ds.index_name('events'))
+        if start or end:
+            start_date = {}
+            if start:
+                start_date['gte'] = start
+            if end:
+                start_date['lte'] = end
+            s = s.filter('range', start_date=start_date)
+        if article_title:
+            s = s.filter('term', article_title=article_title)
+        s = s.sort('start_date', '_id')[0:MAX_SIZE]
+        return [event for event in s.execute()]
+    
+    @staticmethod
+    def index_events(events):
+        """Bulk-index Events, replacing the contents of the events index
+        
+        Creates the index if necessary.  Events that are no longer in
+        the list are removed.
+        
+        @param events: list of Events e.g. from Event.from_psms()
+        @returns: int number of Events indexed
+        """
+        ds = DOCSTORE
+        index = ds.index_name('events')
+        Event.init(index=index, using=ds.es)
+        num,errors = helpers.bulk(ds.es, [
+            {
+                '_index': index,
+                '_id': event.meta.id,
+                '_source': event.to_dict(skip_empty=False),
+            }
+            for event in events
         ])
-        response = s.execute()
-        data = [
-            Event(
-                id = hit.meta.id,
-                published = hitvalue(hit, 'published'),
-                title = hitvalue(hit, 'title'),
-                description = hitvalue(hit, 'description'),
-                start_date = hitvalue(hit, 'start_date'),
-                end_date = hitvalue(hit, 'end_date'),
-                article_title = hitvalue(hit, 'article_title'),
-                resource_uri = hitvalue(hit, 'resource_uri'),
-            )
-            for hit in response
-        ]
-        return data
+        Event.search(using=ds.es, index=index).exclude(
+            'ids', values=[str(event.meta.id) for event in events]
+        ).delete()
+        ds.es.indices.refresh(index=index)
+        return num
     
     @staticmethod
     def from_psms():
@@ -134,13 +168,7 @@ class Event(dsl.Document):
                 obj['end_date'] = datetime.strptime(obj['end_date'], '%Y-%m-%d')
         # keep just the encyclopedia article title
         for obj in objects:
-            obj['article_title'] = ''
-            if obj.get('url'):
-                path = urlparse.urlparse(obj['url']).path
-                if path[0] == '/':
-                    obj['article_title'] = path[1:]
-                else:
-                    obj['article_title'] = path
+            obj['article_title'] = article_title(obj.get('url'))
         # make Events
         events = [
             Event(
@@ -151,6 +179,7 @@ class Event(dsl.Document):
                 start_date = obj['start_date'],
                 end_date = obj['end_date'],
                 article_title = obj['article_title'],
+                url = obj.get('url'),
                 resource_uri = obj['resource_uri'],
             )
             for obj in objects
@@ -1,6 +1,11 @@
+from datetime import date, datetime
+
 from django.test import TestCase
 from django.urls import reverse
 
+from events import backend
+from events import models
+
 
 class APIView(TestCase):
 
@@ -12,9 +17,68 @@ class APIView(TestCase):
         assert response.status_code == 200
         assert b'President Roosevelt signs Executive Order 9066' in response.content
 
+    def test_events_filtered(self):
+        data = {'start': '1942-01-01', 'end': '1942-12-31', 'limit': 5, 'offset': 0}
+        response = self.client.get(reverse('events-api-events'), data)
+        assert response.status_code == 200
+        assert len(response.data['results']) == 5
+        for event in response.data['results']:
+            assert event['start_date'].year == 1942
+        data = {'article_title': 'Executive Order 9066', 'limit': 5, 'cursor': ''}
+        response = self.client.get(reverse('events-api-events'), data)
+        assert response.status_code == 200
+        for event in response.data['results']:
+            assert event['article_title'] == 'Executive Order 9066'
+        data = {'start': '1942'}
+        response = self.client.get(reverse('events-api-events'), data)
+        assert response.status_code == 400
+
+
+class EventIndexTests(TestCase):
+
+    def setUp(self):
+        self.index = backend.EventIndex([
+            {'start_date': datetime(1942, 2, 19), 'article_title': 'Executive Order 9066'},
+            {'start_date': datetime(1942, 3, 2)},
+            {'start_date': datetime(1943, 1, 1), 'article_title': 'Executive Order 9066'},
+            {'start_date': None},
+        ])
+
+    def test_select(self):
+        objects,keys = self.index.select(start=date(1942, 3, 1), end=date(1942, 12, 31))
+        assert objects == [{'start_date': datetime(1942, 3, 2)}]
+        assert keys == ['1942-03-02T00:00:00']
+
+    def test_select_article(self):
+        objects,keys = self.index.select(
+            start=date(1942, 3, 1), article_title='Executive Order 9066'
+        )
+        assert [obj['start_date'] for obj in objects] == [datetime(1943, 1, 1)]
+        assert keys == ['1943-01-01T00:00:00']
+        assert self.index.filter(article_title='Nope') == []
+
 
 class TimelineTests(TestCase):
     
     def test_firstdate(self):
         response = self.client.get(reverse('events-events'))
         assert b'March 26, 1790' in response.content
+
+
+class EventTests(TestCase):
+
+    def test_article_title(self):
+        assert models.article_title(
+            'https://encyclopedia.densho.org/Executive_Order_9066/'
+        ) == 'Executive Order 9066'
+        assert models.article_title('https://encyclopedia.densho.org/Tule%20Lake') == 'Tule Lake'
+        assert models.article_title(None) == ''
+
+    def test_events(self):
+        events = models.Event.events(start=date(1942,1,1), end=date(1942,12,31))
+        assert events
+        for event in events:
+            assert event.start_date.year == 1942
+        events = models.Event.events(article_title='Executive Order 9066')
+        for event in events:
+            assert event.article_title == 'Executive Order 9066'
@@ -1,19 +1,37 @@
+import logging
+logger = logging.getLogger(__name__)
+
+from elasticsearch.exceptions import TransportError
 import requests
 
 from django.conf import settings
 from django.shortcuts import render
 
 from events import backend as ev
+from wikiprox import pagecache
 
 
+@pagecache.tagged('events')
 def events(request, template_name='events/events.html'):
+    status = 200
     try:
         events = ev.events()
         timeout = False
+        error = None
     except requests.exceptions.Timeout:
         events = []
         timeout = True
+        error = None
+        status = 503
+    except TransportError as err:
+        logger.error('Could not load events: %s' % err)
+        events = []
+        timeout = False
+        error = 'events index not available'
+        status = 503
+    # 503s are not kept by the page cache
     return render(request, template_name, {
         'events': events,
         'timeout': timeout,
-    })
+        'error': error,
+    }, status=status)
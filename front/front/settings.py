@@ -198,12 +198,13 @@ REDIS_DB_SORL = 3
 
 CACHES = {
     "default": {
-        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        # RedisCache that reports time spent (see wikiprox.timing)
+        "BACKEND": "wikiprox.timing.TimedRedisCache",
         "LOCATION": f"redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB_CACHE}",
     }
 }
 
-# whole-site caching
+# whole-site caching (see wikiprox.pagecache)
 CACHE_MIDDLEWARE_ALIAS = 'default'
 CACHE_MIDDLEWARE_SECONDS = 60 * 15
 CACHE_MIDDLEWARE_KEY_PREFIX = 'front'
@@ -212,10 +213,14 @@ CACHE_TIMEOUT = 60 * 5
 
 STATIC_ROOT = '/var/www/encycfront/static/'
 MEDIA_ROOT = '/var/www/encycfront/media/'
+# pre-rendered pages served by nginx (see manage.py export_static)
+EXPORT_ROOT = '/var/www/encycfront/html/'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates that reports time spent (see wikiprox.timing)
+        'BACKEND': 'wikiprox.timing.TimedTemplates',
+        'NAME': 'django',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -281,14 +286,18 @@ THUMBNAIL_URL_TIMEOUT = int(config.get('media', 'thumbnail_url_timeout'))
 ##    'django.contrib.staticfiles.finders.DefaultStorageFinder',
 #)
 
-MIDDLEWARE_CLASSES = (
-    'django.middleware.cache.UpdateCacheMiddleware',
+MIDDLEWARE = (
+    # Server-Timing header and log line per request
+    'wikiprox.timing.TimingMiddleware',
     'django.middleware.common.CommonMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    # 304s for pagecache hits (views set ETag/Last-Modified themselves)
+    'django.middleware.http.ConditionalGetMiddleware',
+    #'django.contrib.sessions.middleware.SessionMiddleware',
     #'django.middleware.csrf.CsrfViewMiddleware',
     #'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.cache.FetchFromCacheMiddleware',
+    #'django.contrib.messages.middleware.MessageMiddleware',
+    # full-page cache for views marked with wikiprox.pagecache.tagged
+    'wikiprox.pagecache.PageCacheMiddleware',
 )
 
 ROOT_URLCONF = 'front.urls'
@@ -335,6 +344,12 @@ LOGGING = {
         },
     },
     'loggers': {
+        # one line per request with time spent per phase
+        'wikiprox.timing': {
+            'level': 'INFO',
+            'propagate': False,
+            'handlers': ['file'],
+        },
         'django.request': {
             'level': 'ERROR',
             'propagate': True,
@@ -1,5 +1,4 @@
 from django.views.generic import TemplateView
-from django.contrib.sitemaps.views import sitemap
 from django.urls import include, path, re_path
 
 #from django.contrib import admin
@@ -14,6 +13,8 @@ from wikiprox import sitemaps
 
 SITEMAPS = {
     'pages': sitemaps.PageSitemap,
+    'authors': sitemaps.AuthorSitemap,
+    'sources': sitemaps.SourceSitemap,
 }
 
 urlpatterns = [
@@ -33,7 +34,8 @@ urlpatterns = [
     path('crossdomain.xml', TemplateView.as_view(template_name='crossdomain.xml')),
     path('qr/', TemplateView.as_view(template_name='front/qr.html'), name='qr'),
     path('robots.txt', TemplateView.as_view(template_name='front/robots.txt')),
-    path('sitemap.xml', sitemap, {'sitemaps': SITEMAPS}, name='wikiprox-sitemap'),
+    path('sitemap.xml', sitemaps.index, {'sitemaps': SITEMAPS}, name='wikiprox-sitemap'),
+    path('sitemap-<section>.xml', sitemaps.section, {'sitemaps': SITEMAPS}, name='wikiprox-sitemap-section'),
     #
     path('videotest/', TemplateView.as_view(template_name='wikiprox/LVplusJWPlayer.html')),
     #
@@ -1,28 +1,61 @@
 from collections import OrderedDict
+from urllib.parse import quote
 
 from django.conf import settings
+from django.utils.http import RFC3986_SUBDELIMS
+from django.views.decorators.http import condition
 
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.reverse import reverse
 from rest_framework.response import Response
 
+from wikiprox import conditional
 from wikiprox import models
+from wikiprox import pagination
+
+URL_PLACEHOLDER = 'URLPLACEHOLDER'
+
+
+def url_template(viewname, request=None):
+    """Function that returns the same URL as reverse(viewname, args=[arg])
+
+    For list views: reverse() walks the URL resolver on every call,
+    this does it once.  Only for views that take a single argument.
+
+    @param viewname: str
+    @param request: Request (optional) to make absolute URLs
+    @returns: function(arg)
+    """
+    url = reverse(viewname, args=[URL_PLACEHOLDER], request=request)
+    prefix,suffix = url.split(URL_PLACEHOLDER)
+    # same quoting as django.urls.resolvers.URLResolver._reverse_with_prefix
+    safe = RFC3986_SUBDELIMS + '/~:@'
+    def make_url(arg):
+        return prefix + quote(str(arg), safe=safe) + suffix
+    return make_url
 
 
 @api_view(['GET'])
 def articles(request, format=None):
-    """DOCUMENTATION GOES HERE.
+    """Published articles, by title_sort.
+
+    Paginated with ?limit=&offset= or ?limit=&cursor=; without either
+    the whole list is returned.
     """
-    data = [
-        {
+    page_url = url_template('wikiprox-api-page', request)
+    def row(article):
+        return {
             'title': article.title,
-            'url': reverse('wikiprox-api-page', args=([article.url_title]), request=request),
+            'url': page_url(article.url_title),
         }
-        for article in models.Page.pages()
-    ]
-    return Response(data)
+    data = models.corpus()
+    return pagination.respond(request, data.pages, data.page_keys, row)
 
+@condition(
+    etag_func=conditional.page_etag,
+    last_modified_func=conditional.page_last_modified,
+)
 @api_view(['GET'])
 def article(request, url_title, format=None):
     """DOCUMENTATION GOES HERE.
@@ -78,18 +111,25 @@ def article(request, url_title, format=None):
 
 @api_view(['GET'])
 def authors(request, format=None):
-    """DOCUMENTATION GOES HERE.
+    """Published authors, by title_sort.
+
+    Paginated with ?limit=&offset= or ?limit=&cursor=; without either
+    the whole list is returned.
     """
-    data = [
-        {
+    author_url = url_template('wikiprox-api-author', request)
+    def row(author):
+        return {
             'title': author.title,
             'title_sort': author.title_sort,
-            'url': reverse('wikiprox-api-author', args=([author.url_title]), request=request),
+            'url': author_url(author.url_title),
         }
-        for author in models.Author.authors()
-    ]
-    return Response(data)
+    data = models.corpus()
+    return pagination.respond(request, data.authors, data.author_keys, row)
 
+@condition(
+    etag_func=conditional.author_etag,
+    last_modified_func=conditional.author_last_modified,
+)
 @api_view(['GET'])
 def author(request, url_title, format=None):
     """DOCUMENTATION GOES HERE.
@@ -124,23 +164,47 @@ def author(request, url_title, format=None):
     return Response(data)
 
 
+@condition(etag_func=conditional.corpus_etag)
 @api_view(['GET'])
 def categories(request, format=None):
-    """DOCUMENTATION GOES HERE.
+    """Categories with the number of published articles in each.
+
+    Paginated with ?limit=&offset= or ?limit=&cursor=; without either
+    the whole list is returned.
     """
-    categories = models.Page.pages_by_category()
-    assert False
-    return Response(data)
+    category_url = url_template('wikiprox-api-category', request)
+    def row(item):
+        category,pages = item
+        return {
+            'title': category,
+            'count': len(pages),
+            'url': category_url(category),
+        }
+    data = models.corpus()
+    return pagination.respond(
+        request, data.pages_by_category, data.category_names, row
+    )
 
+@condition(etag_func=conditional.corpus_etag)
 @api_view(['GET'])
 def category(request, category, format=None):
-    """DOCUMENTATION GOES HERE.
+    """Published articles in a category, by title_sort.
+
+    Paginated with ?limit=&offset= or ?limit=&cursor=; without either
+    the whole list is returned.
     """
-    #categories = Backend().categories()
-    #articles_by_category = [(key,val) for key,val in categories.items()]
-    assert False
-    data = {}
-    return Response(data)
+    data = models.corpus()
+    if category not in data.category_index:
+        return Response(status=status.HTTP_404_NOT_FOUND)
+    page_url = url_template('wikiprox-api-page', request)
+    def row(article):
+        return {
+            'title': article['title'],
+            'url': page_url(article['url_title']),
+        }
+    return pagination.respond(
+        request, data.category_index[category], data.category_keys[category], row
+    )
 
 
 @api_view(['GET'])
@@ -148,6 +212,10 @@ def sources(request, format=None):
     # can't browse sources independent of articles
     return Response(status=status.HTTP_404_NOT_FOUND)
 
+@condition(
+    etag_func=conditional.source_etag,
+    last_modified_func=conditional.source_last_modified,
+)
 @api_view(['GET'])
 def source(request, encyclopedia_id, format=None):
     """DOCUMENTATION GOES HERE.
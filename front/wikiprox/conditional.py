@@ -0,0 +1,186 @@
+"""wikiprox.conditional -- Validators for conditional GET
+
+ETag and Last-Modified functions for
+django.views.decorators.http.condition.  They must be cheap: they run
+on every request, including the ones answered with 304, so they only
+look at the light objects in the Corpus, never at the docstore.
+
+Document validators cover the document's own modified date plus the
+other Corpus data its page shows (e.g. an article's sources and
+previous/next links).  Documents that are not in the Corpus (e.g.
+unpublished, or added since it was built) get no validators and are
+rendered as usual.
+"""
+from datetime import datetime
+import hashlib
+
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+
+from wikiprox import models
+
+
+def make_etag(*parts):
+    """Hash of the front version and parts
+
+    Including settings.VERSION changes every ETag on deploy, when
+    templates or API output may have changed.
+
+    @param parts: objects with stable repr()s
+    @returns: str
+    """
+    data = repr((settings.VERSION,) + parts).encode('utf-8')
+    return hashlib.sha1(data).hexdigest()
+
+def corpus_etag(request, *args, **kwargs):
+    """ETag for views rendered entirely from the Corpus
+    """
+    return _document_etag(request, models.corpus().generation)
+
+def to_datetime(value):
+    """datetime from a document's modified (str or datetime), or None
+    """
+    if isinstance(value, str):
+        return parse_datetime(value)
+    if isinstance(value, datetime):
+        return value
+    return None
+
+def _latest(objects):
+    dates = [
+        to_datetime(getattr(o, 'modified', None)) for o in objects
+    ]
+    dates = [d for d in dates if d]
+    if dates:
+        return max(dates)
+    return None
+
+def _document_etag(request, *parts):
+    # One representation per path and Accept (API views negotiate format)
+    return make_etag(
+        request.get_full_path(), request.META.get('HTTP_ACCEPT'), *parts
+    )
+
+
+def _page(url_title, data=None):
+    """Light Page, titles of its previous/next pages, its light Sources
+    """
+    if data is None:
+        data = models.corpus()
+    page = data.pages_by_url_title.get(url_title)
+    if not page:
+        # wikiprox.views.article accepts underscores in place of spaces
+        page = data.pages_by_url_title.get(url_title.replace('_', ' '))
+    if not page:
+        return None,None,[]
+    prev_next = [
+        getattr(p, 'title', None)
+        for p in data.prev_next.get(page.title, (None, None))
+    ]
+    sources = [
+        data.sources_by_id[source_id]
+        for source_id in (getattr(page, 'source_ids', None) or [])
+        if source_id in data.sources_by_id
+    ]
+    return page,prev_next,sources
+
+def page_version(url_title, data=None):
+    """Values an article's page depends on, or None if not in the Corpus
+
+    Also used by `manage.py export_static` and to purge the page cache
+    (see models.build_corpus).
+
+    @param url_title: str
+    @param data: Corpus (default: models.corpus())
+    @returns: tuple or None
+    """
+    if data is None:
+        data = models.corpus()
+    page,prev_next,sources = _page(url_title, data)
+    if not page:
+        return None
+    authors = data.authors_by_url_title
+    author_names = [
+        getattr(authors.get(name), 'title', name)
+        for name in (getattr(page, 'authors_data', None) or {}).get('display', [])
+    ]
+    return (
+        page.url_title, page.modified, prev_next,
+        [(source.encyclopedia_id, source.modified) for source in sources],
+        author_names,
+    )
+
+def page_etag(request, url_title='index', *args, **kwargs):
+    version = page_version(url_title)
+    if not version:
+        return None
+    return _document_etag(request, *version)
+
+def page_last_modified(request, url_title='index', *args, **kwargs):
+    page,prev_next,sources = _page(url_title)
+    if not page:
+        return None
+    return _latest([page] + sources)
+
+
+def _author(url_title, data=None):
+    if data is None:
+        data = models.corpus()
+    author = data.authors_by_url_title.get(url_title)
+    if not author:
+        return None,[]
+    return author,data.articles_by_author.get(author.url_title, [])
+
+def author_version(url_title, data=None):
+    """Values an author's page depends on, or None if not in the Corpus
+
+    @param url_title: str
+    @param data: Corpus (default: models.corpus())
+    @returns: tuple or None
+    """
+    author,articles = _author(url_title, data)
+    if not author:
+        return None
+    return (
+        author.url_title, author.modified,
+        [article.title for article in articles],
+    )
+
+def author_etag(request, url_title, *args, **kwargs):
+    version = author_version(url_title)
+    if not version:
+        return None
+    return _document_etag(request, *version)
+
+def author_last_modified(request, url_title, *args, **kwargs):
+    author,articles = _author(url_title)
+    if not author:
+        return None
+    return _latest([author])
+
+
+def source_version(encyclopedia_id, data=None):
+    """Values a source's page depends on, or None if not in the Corpus
+
+    @param encyclopedia_id: str
+    @param data: Corpus (default: models.corpus())
+    @returns: tuple or None
+    """
+    if data is None:
+        data = models.corpus()
+    source = data.sources_by_id.get(encyclopedia_id)
+    if not source:
+        return None
+    return (source.encyclopedia_id, source.modified)
+
+def source_etag(request, encyclopedia_id, *args, **kwargs):
+    version = source_version(encyclopedia_id)
+    if not version:
+        return None
+    return _document_etag(request, *version)
+
+def source_last_modified(request, encyclopedia_id, *args, **kwargs):
+    source = models.corpus().sources_by_id.get(encyclopedia_id)
+    if not source:
+        return None
+    return _latest([source])
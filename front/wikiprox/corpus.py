@@ -0,0 +1,250 @@
+"""wikiprox.corpus -- Snapshot of the published encyclopedia
+
+A Corpus holds the light Page, Author, Source and FacetTerm objects for
+the whole published encyclopedia plus the indexes the list views need.
+It is built in one go by wikiprox.models.corpus(), which keeps one
+Corpus per worker process and replaces it only when the docstore
+generation changes.
+
+IMPORTANT: Corpus objects are shared by every request in a process.
+Treat them as read-only; copy anything you need to modify.
+
+Functions in this module only arrange objects that have already been
+loaded.  They do not talk to Elasticsearch.
+"""
+from collections import OrderedDict
+from datetime import datetime
+
+
+class Corpus():
+    """Published encyclopedia content and indexes derived from it
+    """
+    generation = None
+    built = None
+    pages = []
+    authors = []
+    sources = []
+    titles = []
+    page_keys = []
+    author_keys = []
+    pages_by_title = {}
+    pages_by_url_title = {}
+    authors_by_url_title = {}
+    sources_by_id = {}
+    pages_modified = None
+    authors_modified = None
+    sources_modified = None
+    prev_next = {}
+    pages_by_category = []
+    category_names = []
+    category_index = {}
+    category_keys = {}
+    pages_by_initial = OrderedDict()
+    topics_by_url = {}
+    articles_by_author = {}
+    articles_by_topic = {}
+
+    def __init__(self, generation, pages, authors, sources, terms,
+                 hidden_categories=[], ddr_topics_base=''):
+        """
+        @param generation: Opaque value identifying docstore contents
+        @param pages: list of light Pages, sorted
+        @param authors: list of light Authors, sorted
+        @param sources: list of light Sources, sorted
+        @param terms: list of topic FacetTerms
+        @param hidden_categories: list Categories not shown to the public
+        @param ddr_topics_base: str Base URL of DDR topic pages
+        """
+        self.generation = generation
+        self.built = datetime.now()
+        self.pages = pages
+        self.authors = authors
+        self.sources = sources
+        self.titles = [page.title for page in pages]
+        # sort keys, for bisecting
+        self.page_keys = [page.title_sort for page in pages]
+        self.author_keys = [author.title_sort for author in authors]
+        self.pages_by_title = {page.title: page for page in pages}
+        self.pages_by_url_title = {page.url_title: page for page in pages}
+        self.authors_by_url_title = {
+            author.url_title: author for author in authors
+        }
+        self.sources_by_id = {
+            source.encyclopedia_id: source for source in sources
+        }
+        self.prev_next = prev_next(pages)
+        self.pages_modified = latest_modified(pages)
+        self.authors_modified = latest_modified(authors)
+        self.sources_modified = latest_modified(sources)
+        self.pages_by_category = by_category(pages, hidden_categories)
+        self.category_names = [
+            category for category,pages in self.pages_by_category
+        ]
+        self.category_index = dict(self.pages_by_category)
+        self.category_keys = {
+            category: [page['title_sort'] for page in pages]
+            for category,pages in self.pages_by_category
+        }
+        self.pages_by_initial = by_initial(pages)
+        self.topics_by_url = topics_by_url(terms, ddr_topics_base)
+        self.articles_by_author = {
+            author.url_title: pages_for_titles(
+                self.pages_by_url_title, author.article_titles
+            )
+            for author in authors
+        }
+        self.articles_by_topic = {
+            term.term_id: pages_for_titles(
+                self.pages_by_title, [url['title'] for url in term.encyc_urls]
+            )
+            for term in terms
+            if hasattr(term, 'encyc_urls') and term.encyc_urls
+        }
+
+    def __repr__(self):
+        return "<%s.%s %s pages %s authors %s sources>" % (
+            self.__module__,
+            self.__class__.__name__,
+            len(self.pages),
+            len(self.authors),
+            len(self.sources),
+        )
+
+
+def page_dict(page):
+    """Only the data needed to display a page in a list
+
+    @param page: Page
+    @returns: dict
+    """
+    return {
+        'first_letter': page.title_sort[0].upper(),
+        'title_sort': page.title_sort,
+        'title': page.title,
+        'url_title': page.url_title,
+        'absolute_url': page.absolute_url(),
+    }
+
+def pages_for_titles(pages_by_title, titles):
+    """Published pages matching titles, sorted like Corpus.pages
+
+    Titles of missing or unpublished pages are ignored.
+    Cost is proportional to len(titles), not to the number of pages.
+
+    @param pages_by_title: dict Page title or url_title: Page
+    @param titles: list
+    @returns: list of Pages
+    """
+    if not titles:
+        return []
+    return sorted([
+        pages_by_title[title]
+        for title in set(titles)
+        if title in pages_by_title
+    ])
+
+def latest_modified(objects):
+    """Most recent modified value of objects, or None
+
+    @param objects: list of Pages, Authors, or Sources
+    @returns: modified value (str or datetime) as loaded
+    """
+    values = [
+        getattr(o, 'modified', None) for o in objects
+        if getattr(o, 'modified', None)
+    ]
+    if values:
+        return max(values, key=str)
+    return None
+
+def prev_next(pages):
+    """Dict of Page title: (previous light Page, next light Page)
+
+    @param pages: list of Pages, sorted
+    @returns: dict
+    """
+    data = {}
+    for n,page in enumerate(pages):
+        prev_page = None
+        next_page = None
+        if n > 0:
+            prev_page = pages[n-1]
+        if n < len(pages) - 1:
+            next_page = pages[n+1]
+        data[page.title] = (prev_page, next_page)
+    return data
+
+def by_category(pages, hidden_categories):
+    """List of (category, pages) tuples, alphabetical by category
+
+    Single pass over pages.  As before, a page appears at most once per
+    category, pages comparing equal (same title_sort) count as the same
+    page, and internal editorial categories are left out.
+
+    @param pages: list of Pages, sorted
+    @param hidden_categories: list Internal editorial categories
+    @returns: list of (category, [page_dict, ...])
+    """
+    hidden = set(hidden_categories)
+    categories = {}
+    seen = {}
+    for page in pages:
+        for category in page.categories:
+            # exclude internal editorial categories
+            if category in hidden:
+                continue
+            if category not in categories:
+                categories[category] = []
+                seen[category] = set()
+            # pages already sorted so category lists will be sorted
+            if page.title_sort not in seen[category]:
+                seen[category].add(page.title_sort)
+                categories[category].append(page)
+    # keep only the data needed for display
+    return [
+        (key, [page_dict(page) for page in categories[key]])
+        for key in sorted(categories.keys())
+    ]
+
+def by_initial(pages):
+    """OrderedDict of initial: [page_dict, ...]
+
+    @param pages: list of Pages
+    @returns: OrderedDict
+    """
+    data = OrderedDict()
+    data['1-10'] = []
+    for c in 'abcdefghijklmnopqrstuvwxyz':
+        data[c] = []
+    for page in pages:
+        initial = page.title_sort[0].lower()
+        if initial.isdigit():
+            initial = '1-10'
+        data[initial].append(page_dict(page))
+    for initial,pages in data.items():
+        data[initial] = sorted(
+            pages, key=lambda page: page['title_sort']
+        )
+    return data
+
+def topics_by_url(terms, ddr_topics_base):
+    """Dict of ENCYCLOPEDIA_TITLE:[FacetTerm,...]
+
+    @param terms: list of FacetTerms
+    @param ddr_topics_base: str Base URL of DDR topic pages
+    @returns: dict
+    """
+    data = {}
+    for term in terms:
+        if hasattr(term, 'encyc_urls') and term.encyc_urls:
+            for url in term.encyc_urls:
+                # Add URL of DDR topic page
+                term['ddr_topic_url'] = '%s/%s/' % (
+                    ddr_topics_base, term['term_id']
+                )
+                # insert into dict by page title
+                title = url['title']
+                if not data.get(title, None):
+                    data[title] = []
+                data[title].append(term)
+    return data
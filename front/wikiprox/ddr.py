@@ -1,58 +1,194 @@
 """front.ddr -- Links to the DDR REST API
 """
+from concurrent.futures import ThreadPoolExecutor, wait
 import json
+import logging
+logger = logging.getLogger(__name__)
 import os
+import threading
+import time
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from django.conf import settings
 from django.core.cache import cache
 
 from wikiprox import make_cache_key
+from wikiprox import stats
+from wikiprox import timing
 
+# Timeout (seconds) for a single DDR API request
+TERM_TIMEOUT = 3
+# Overall deadline (seconds) for all of a page's term requests.
+# Terms that are not back by then are left empty.
+RELATED_DEADLINE = 4
+# Number of term requests to run at the same time (per process)
+MAX_WORKERS = 8
 
-def _term_documents(term_id, size):
+# One cache entry per term, serving any size up to the size fetched
+TERM_KEY = 'wikiprox:ddr:termdocs:%s'
+# Objects fetched per term (more if a caller asks for more)
+TERM_FETCH_SIZE = 100
+# Entries older than this (seconds) are refreshed in the background
+TERM_FRESH = settings.CACHE_TIMEOUT
+# Stale entries are served until they expire
+TERM_CACHE_TIMEOUT = 60 * 60 * 24
+# Only one process refreshes a term at a time
+TERM_LOCK_KEY = 'wikiprox:ddr:termdocs-lock:%s'
+TERM_LOCK_TIMEOUT = TERM_TIMEOUT * 10
+# Background refreshes run on their own small pool, never on executor(),
+# and at most REFRESH_QUEUE are waiting or running at once (per process)
+REFRESH_WORKERS = 2
+REFRESH_QUEUE = 16
+
+_lock = threading.Lock()
+_session = None
+_executor = None
+_refresh_executor = None
+_refreshes = threading.BoundedSemaphore(REFRESH_QUEUE)
+
+def session():
+    """requests.Session with a connection pool shared by all DDR requests
+    
+    Created on first use so that nothing is opened before gunicorn forks.
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_WORKERS)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+    return _session
+
+def executor():
+    """Thread pool used to fetch topic terms concurrently
+    """
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=MAX_WORKERS, thread_name_prefix='ddr'
+            )
+    return _executor
+
+def refresh_executor():
+    """Thread pool for background refreshes of stale terms
+    """
+    global _refresh_executor
+    with _lock:
+        if _refresh_executor is None:
+            _refresh_executor = ThreadPoolExecutor(
+                max_workers=REFRESH_WORKERS, thread_name_prefix='ddr-refresh'
+            )
+    return _refresh_executor
+
+
+def _term_key(term_id):
+    return make_cache_key(TERM_KEY % term_id)
+
+def _fetch_term_documents(term_id, size):
     """Get objects for specified term from DDR REST API.
     
     @param term_id: int
     @param size: int Maximum number of results to return.
     @returns: list of dicts
     """
-    cache_key = make_cache_key('wikiprox:ddr:termdocs:%s:%s' % (term_id,size))
-    cached = cache.get(cache_key)
+    url = '{api}/facet/topics/{term_id}/objects/?limit={limit}&{local}=1'.format(
+        api=settings.DDR_API,
+        term_id=term_id,
+        limit=size,
+        local=settings.DDR_MEDIA_URL_LOCAL_MARKER
+    )
+    r = session().get(
+        url,
+        headers={'content-type':'application/json'},
+        timeout=TERM_TIMEOUT)
+    if (r.status_code not in [200]):
+        raise requests.exceptions.ConnectionError(
+            'Error %s' % (r.status_code))
+    objects = []
+    if ('json' in r.headers['content-type']):
+        data = json.loads(r.text)
+        if isinstance(data, dict) and data.get('objects'):
+            objects = data['objects']
+        elif isinstance(data, list):
+            objects = data
+    # add img_url_local
+    for o in objects:
+        if o.get('links',{}).get('html'):
+            o['absolute_url'] = o['links']['html']
+        if o.get('links',{}).get('thumb'):
+            o['img_url'] = o['links']['img']
+        if o.get('links',{}).get('thumb'):
+            o['img_url_local'] = o['links']['thumb']
+    return objects
+
+def _store_term_documents(term_id, size):
+    """Fetch objects for a term and cache them
+    
+    @param term_id: int
+    @param size: int Number of objects fetched
+    @returns: dict cache entry
+    """
+    entry = {
+        'size': size,
+        'fetched': time.time(),
+        'objects': _fetch_term_documents(term_id, size),
+    }
+    cache.set(_term_key(term_id), json.dumps(entry), TERM_CACHE_TIMEOUT)
+    return entry
+
+def _refresh_in_background(term_id, size):
+    try:
+        _store_term_documents(term_id, size)
+    except Exception as err:
+        logger.warning('DDR term %s refresh: %s' % (term_id, err))
+    finally:
+        cache.delete(make_cache_key(TERM_LOCK_KEY % term_id))
+        _refreshes.release()
+
+def _term_documents(term_id, size):
+    """Get objects for specified term, from the cache if possible
+    
+    There is one cache entry per term, holding at least TERM_FETCH_SIZE
+    objects, and smaller sizes are sliced from it.  Entries older than
+    TERM_FRESH are still served but are refreshed in the background
+    (by the process that gets the term's lock), so readers only wait
+    for the DDR API when a term is not cached at all.
+    
+    Counted in stats group 'ddr-terms': 'hits', 'misses', 'stale-served'.
+    
+    @param term_id: int
+    @param size: int Maximum number of results to return.
+    @returns: list of dicts
+    """
+    cached = cache.get(_term_key(term_id))
+    entry = None
     if cached:
-        objects = json.loads(cached)
+        entry = json.loads(cached)
+        # a short list means the term has no more objects
+        complete = len(entry['objects']) < entry['size']
+        if (entry['size'] < size) and not complete:
+            entry = None
+    if entry is None:
+        stats.incr('ddr-terms', 'misses')
+        entry = _store_term_documents(term_id, max(size, TERM_FETCH_SIZE))
+    elif time.time() - entry['fetched'] > TERM_FRESH:
+        stats.incr('ddr-terms', 'stale-served')
+        lock_key = make_cache_key(TERM_LOCK_KEY % term_id)
+        # if the refresh queue is full, a later reader will try again
+        if _refreshes.acquire(blocking=False):
+            if cache.add(lock_key, os.getpid(), TERM_LOCK_TIMEOUT):
+                refresh_executor().submit(
+                    _refresh_in_background, term_id, entry['size']
+                )
+            else:
+                _refreshes.release()
     else:
-        url = '{api}/facet/topics/{term_id}/objects/?limit={limit}&{local}=1'.format(
-            api=settings.DDR_API,
-            term_id=term_id,
-            limit=size,
-            local=settings.DDR_MEDIA_URL_LOCAL_MARKER
-        )
-        r = requests.get(
-            url,
-            headers={'content-type':'application/json'},
-            timeout=3)
-        if (r.status_code not in [200]):
-            raise requests.exceptions.ConnectionError(
-                'Error %s' % (r.status_code))
-        objects = []
-        if ('json' in r.headers['content-type']):
-            data = json.loads(r.text)
-            if isinstance(data, dict) and data.get('objects'):
-                objects = data['objects']
-            elif isinstance(data, list):
-                objects = data
-        # add img_url_local
-        for o in objects:
-            if o.get('links',{}).get('html'):
-                o['absolute_url'] = o['links']['html']
-            if o.get('links',{}).get('thumb'):
-                o['img_url'] = o['links']['img']
-            if o.get('links',{}).get('thumb'):
-                o['img_url_local'] = o['links']['thumb']
-        cache.set(cache_key, json.dumps(objects), settings.CACHE_TIMEOUT)
-    return objects
+        stats.incr('ddr-terms', 'hits')
+    return entry['objects'][:size]
 
 def _balance(results, size):
     """cycle through term IDs taking one at a time until we have enough
@@ -145,12 +281,42 @@ def distribute_list(terms_objects, limit):
                 misses = misses + 1
     return objects
 
-def related_by_topic(terms, size):
+def related_by_topic(terms, size, deadline=RELATED_DEADLINE):
     """Add related documents from DDR to terms
     
+    Terms are fetched concurrently.  Terms that fail or are not back
+    before the deadline get an empty list of objects.
+    If no term could be fetched at all the first error is raised so that
+    views can report ConnectionError/Timeout as before.
+    
     @param terms: list of FacetTerms.
     @param size: int Number of results per term.
+    @param deadline: int Seconds to wait for all terms.
     """
-    for term in terms:
-        term['objects'] = _term_documents(term['term_id'], size)
+    if not terms:
+        return terms
+    futures = {
+        executor().submit(_term_documents, term['term_id'], size): term
+        for term in terms
+    }
+    # requests run on executor threads; count the time spent waiting
+    with timing.phase('ddr', calls=len(terms)):
+        done,not_done = wait(futures.keys(), timeout=deadline)
+    errors = []
+    for future,term in futures.items():
+        term['objects'] = []
+        if future in not_done:
+            # don't leave it queued ahead of later pages' terms
+            future.cancel()
+            logger.warning('DDR term %s missed deadline' % term['term_id'])
+            errors.append(requests.exceptions.Timeout(
+                'DDR term %s missed deadline' % term['term_id']
+            ))
+        elif future.exception():
+            logger.warning('DDR term %s: %s' % (term['term_id'], future.exception()))
+            errors.append(future.exception())
+        else:
+            term['objects'] = future.result()
+    if errors and (len(errors) == len(terms)):
+        raise errors[0]
     return terms
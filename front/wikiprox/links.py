@@ -0,0 +1,60 @@
+"""wikiprox.links -- Rewrite internal links in article bodies
+
+Article bodies from encyc-core mark internal links with class="encyc"
+and point them at "/wiki/TITLE".  Before display the "/wiki" is removed
+and a trailing slash is added, so the links match front's URL patterns.
+
+This is done in a single pass over the raw HTML: only <a> start tags
+are examined and everything else is copied through unchanged.
+"""
+import re
+
+# An HTML comment, or an <a> start tag (attribute values may contain '>').
+TAG_REGEX = re.compile(
+    r'<!--.*?-->|<a\b(?:[^>"\']|"[^"]*"|\'[^\']*\')*>',
+    re.IGNORECASE | re.DOTALL
+)
+ATTR_REGEX = re.compile(
+    r'([^\s"\'<>/=]+)(\s*=\s*)("[^"]*"|\'[^\']*\'|[^\s"\'=<>`]+)'
+)
+
+
+def _unquote(value):
+    if value[:1] in ['"', "'"]:
+        return value[0], value[1:-1]
+    return '', value
+
+def _rewrite_href(href):
+    href = href.replace('/wiki', '')
+    if href and (href[-1] != '/'):
+        href += '/'
+    return href
+
+def _rewrite_tag(match):
+    tag = match.group(0)
+    if tag.startswith('<!--'):
+        return tag
+    attrs = {
+        m.group(1).lower(): m
+        for m in ATTR_REGEX.finditer(tag)
+    }
+    if not (attrs.get('class') and attrs.get('href')):
+        return tag
+    quote,classes = _unquote(attrs['class'].group(3))
+    if 'encyc' not in classes.split():
+        return tag
+    href = attrs['href']
+    quote,value = _unquote(href.group(3))
+    return ''.join([
+        tag[:href.start(3)],
+        quote, _rewrite_href(value), quote,
+        tag[href.end(3):],
+    ])
+
+def rewrite_links(html):
+    """Remove "/wiki" from and add trailing slash to <a class="encyc"> hrefs
+
+    @param html: str
+    @returns: str
+    """
+    return TAG_REGEX.sub(_rewrite_tag, html)
@@ -0,0 +1,179 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import json
+import multiprocessing
+import os
+import time
+from urllib.parse import unquote
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from wikiprox import conditional
+from wikiprox import models
+from wikiprox.conditional import make_etag
+from wikiprox.management.commands.warm_cache import default_host
+
+# {path: version} of the last export, kept in the export root
+MANIFEST = '.export.json'
+
+# Set up in each worker process
+_client = None
+
+
+class Command(BaseCommand):
+    help = 'Render article, author, source and list pages to HTML files for nginx.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-o', '--output', default=settings.EXPORT_ROOT,
+            help='Directory to write to (default: settings.EXPORT_ROOT).'
+        )
+        parser.add_argument(
+            '-p', '--processes', type=int, default=os.cpu_count(),
+            help='Number of rendering processes (default: number of CPUs).'
+        )
+        parser.add_argument(
+            '-f', '--force', action='store_true',
+            help='Render everything, not just documents that changed.'
+        )
+        parser.add_argument(
+            '--host',
+            help='Host header to send (default: first of ALLOWED_HOSTS).'
+        )
+
+    def handle(self, *args, **options):
+        output = options['output']
+        if options['processes'] < 1:
+            raise CommandError('--processes must be at least 1')
+        host = options['host'] or default_host()
+        started = time.monotonic()
+
+        manifest_path = os.path.join(output, MANIFEST)
+        previous = {}
+        if os.path.exists(manifest_path) and not options['force']:
+            with open(manifest_path, 'r') as f:
+                previous = json.loads(f.read())
+        current = export_versions()
+        paths = [
+            path for path,version in current.items()
+            if previous.get(path) != version
+        ]
+        removed = [path for path in previous if path not in current]
+        self.stdout.write('%s pages, %s changed, %s removed' % (
+            len(current), len(paths), len(removed)
+        ))
+
+        failed = {}
+        # spawn rather than fork: connection pools must not be shared
+        with ProcessPoolExecutor(
+                max_workers=options['processes'],
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker, initargs=(host,)) as pool:
+            futures = {
+                pool.submit(_export, path, output): path for path in paths
+            }
+            for n,future in enumerate(as_completed(futures), start=1):
+                path = futures[future]
+                try:
+                    status = future.result()
+                    if status != 200:
+                        failed[path] = status
+                except Exception as err:
+                    failed[path] = err
+                if n % 100 == 0:
+                    self.stdout.write('%s/%s %.1f/s' % (
+                        n, len(paths), n / (time.monotonic() - started)
+                    ))
+
+        # nginx must not serve pages that are gone or failed to render
+        for path in removed + list(failed.keys()):
+            filename = export_filename(output, path)
+            if os.path.exists(filename):
+                os.remove(filename)
+        for path,error in failed.items():
+            self.stderr.write('FAIL %s %s' % (path, error))
+            current.pop(path)
+        os.makedirs(output, exist_ok=True)
+        _write(manifest_path, json.dumps(current).encode('utf-8'))
+
+        elapsed = time.monotonic() - started
+        self.stdout.write('%s pages in %.1fs (%.1f/s), %s failed' % (
+            len(paths), elapsed, len(paths) / elapsed if elapsed else 0,
+            len(failed)
+        ))
+
+
+def export_versions():
+    """{path: version} for every exported page
+
+    Document versions come from the same values as their ETags (see
+    wikiprox.conditional), so a page is exported again whenever anything
+    it displays changes.
+
+    @returns: dict
+    """
+    corpus = models.corpus()
+    versions = {}
+    for page in corpus.pages:
+        path = _slash(reverse('wikiprox-page', args=[page.url_title]))
+        versions[path] = make_etag(*conditional.page_version(page.url_title))
+    for author in corpus.authors:
+        path = reverse('wikiprox-author', args=[author.url_title])
+        versions[path] = make_etag(*conditional.author_version(author.url_title))
+    for source in corpus.sources:
+        path = reverse('wikiprox-source', args=[source.encyclopedia_id])
+        versions[path] = make_etag(
+            *conditional.source_version(source.encyclopedia_id)
+        )
+    pages_version = make_etag(len(corpus.pages), str(corpus.pages_modified))
+    versions[reverse('wikiprox-contents')] = pages_version
+    versions[reverse('wikiprox-categories')] = pages_version
+    versions[reverse('wikiprox-authors')] = make_etag(
+        len(corpus.authors), str(corpus.authors_modified)
+    )
+    # events come from elsewhere, so the timeline is always rendered
+    versions[reverse('events-events')] = make_etag(time.time())
+    return versions
+
+def export_filename(output, path):
+    """File nginx serves for path (see conf/nginx.conf)
+
+    @param output: str Export root
+    @param path: str URL path
+    @returns: str
+    """
+    return os.path.join(output, unquote(path).lstrip('/'), 'index.html')
+
+def _slash(path):
+    # one file serves both /Title and /Title/ (see conf/nginx.conf)
+    if not path.endswith('/'):
+        return path + '/'
+    return path
+
+def _write(filename, content):
+    tmp = '%s.%s.tmp' % (filename, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(content)
+    os.replace(tmp, filename)
+
+def _init_worker(host):
+    global _client
+    import django
+    django.setup()
+    from django.test import Client
+    _client = Client(HTTP_HOST=host)
+
+def _export(path, output):
+    """Render path and write it to the export root
+
+    @param path: str
+    @param output: str
+    @returns: int HTTP status
+    """
+    response = _client.get(path)
+    if response.status_code == 200:
+        filename = export_filename(output, path)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        _write(filename, response.content)
+    return response.status_code
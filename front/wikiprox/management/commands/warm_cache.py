@@ -0,0 +1,141 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from wikiprox import models
+from wikiprox.conditional import to_datetime
+
+# List views, rendered every time
+LIST_VIEWS = [
+    'wikiprox-contents',
+    'wikiprox-categories',
+    'wikiprox-authors',
+    'events-events',
+    'wikiprox-sitemap',
+]
+SITEMAP_SECTIONS = ['pages', 'authors', 'sources']
+
+
+class Command(BaseCommand):
+    help = 'Render every article, author and source page to fill the caches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-w', '--workers', type=int, default=4,
+            help='Number of pages to render at the same time.'
+        )
+        parser.add_argument(
+            '-m', '--modified-since',
+            help='Only documents modified since this date (YYYY-MM-DD[THH:MM:SS]).'
+        )
+        parser.add_argument(
+            '--host',
+            help='Host header to send (default: first of ALLOWED_HOSTS).'
+        )
+
+    def handle(self, *args, **options):
+        since = None
+        if options['modified_since']:
+            since = parse_datetime(options['modified_since'])
+            if not since:
+                date = parse_date(options['modified_since'])
+                if date:
+                    since = datetime.combine(date, datetime.min.time())
+            if not since:
+                raise CommandError(
+                    'Bad --modified-since: %s' % options['modified_since']
+                )
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1')
+        host = options['host'] or default_host()
+
+        started = time.monotonic()
+        urls = warm_urls(since)
+        self.stdout.write('Warming %s URLs with %s workers' % (
+            len(urls), options['workers']
+        ))
+        local = threading.local()
+        def get(url):
+            # Clients keep cookies, so one per thread
+            if not hasattr(local, 'client'):
+                local.client = Client(HTTP_HOST=host)
+            return local.client.get(url).status_code
+
+        failures = []
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            futures = {pool.submit(get, url): url for url in urls}
+            for n,future in enumerate(as_completed(futures), start=1):
+                url = futures[future]
+                try:
+                    status = future.result()
+                    if status != 200:
+                        failures.append((url, status))
+                except Exception as err:
+                    failures.append((url, err))
+                if n % 100 == 0:
+                    self.stdout.write('%s/%s %.1f/s' % (
+                        n, len(urls), n / (time.monotonic() - started)
+                    ))
+
+        for url,error in failures:
+            self.stderr.write('FAIL %s %s' % (url, error))
+        elapsed = time.monotonic() - started
+        self.stdout.write('%s URLs in %.1fs (%.1f/s), %s failed' % (
+            len(urls), elapsed, len(urls) / elapsed if elapsed else 0,
+            len(failures)
+        ))
+
+
+def default_host():
+    for host in settings.ALLOWED_HOSTS:
+        if host and ('*' not in host) and not host.startswith('.'):
+            return host
+    return 'localhost'
+
+def modified_since(obj, since):
+    """True if obj was modified at or after since (or has no modified)
+
+    @param obj: Page, Author, or Source
+    @param since: datetime
+    @returns: bool
+    """
+    modified = to_datetime(getattr(obj, 'modified', None))
+    if not modified:
+        return True
+    # ES dates may or may not have a timezone
+    if timezone.is_aware(modified) and timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    elif timezone.is_naive(modified) and timezone.is_aware(since):
+        modified = timezone.make_aware(modified)
+    return modified >= since
+
+def warm_urls(since=None):
+    """URLs whose renders fill the page, fragment, body and DDR caches
+
+    @param since: datetime Only documents modified since then, or None
+    @returns: list of str
+    """
+    urls = []
+    for objects,viewname,arg in [
+        (models.Page.pages(), 'wikiprox-page', 'url_title'),
+        (models.Author.authors(), 'wikiprox-author', 'url_title'),
+        (models.Source.sources(), 'wikiprox-source', 'encyclopedia_id'),
+    ]:
+        for obj in objects:
+            if since and not modified_since(obj, since):
+                continue
+            urls.append(reverse(viewname, args=[getattr(obj, arg)]))
+    urls += [reverse(viewname) for viewname in LIST_VIEWS]
+    urls += [
+        reverse('wikiprox-sitemap-section', args=[section])
+        for section in SITEMAP_SECTIONS
+    ]
+    return urls
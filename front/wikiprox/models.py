@@ -1,41 +1,88 @@
-from collections import OrderedDict
 from datetime import datetime
-import json
+import copy
+import hashlib
 import logging
 logger = logging.getLogger(__name__)
 import os
+import threading
+import time
 
-from bs4 import BeautifulSoup
-import requests
-
-from elasticsearch.exceptions import NotFoundError
+from elasticsearch.exceptions import NotFoundError, TransportError
 import elasticsearch_dsl as dsl
 
 from django.conf import settings
 from django.core.cache import cache
-from django.db import models
 from django.urls import reverse
+from django.utils.functional import SimpleLazyObject
 
 from elastictools import docstore
 from wikiprox import citations
+from wikiprox import corpus as corpus_
+from wikiprox.corpus import Corpus
 from wikiprox import ddr
+from wikiprox import links
+from wikiprox import make_cache_key
+from wikiprox import pagecache
 from wikiprox import repo_models
 from wikiprox import search
-from wikiprox import sources
+from wikiprox import stats
+from wikiprox import timing
 
 INDEX_PREFIX = 'encyc'
 
-# see if cluster is available, quit with nice message if not
-docstore.Docstore(INDEX_PREFIX, settings.DOCSTORE_HOST, settings).start_test()
+# Seconds between attempts to reach the cluster while it is unavailable
+DOCSTORE_PROBE_INTERVAL = 10
+
+def _probe_docstore(ds):
+    """See if cluster is available, retrying until it is; log if not
+    """
+    while True:
+        try:
+            ds.start_test()
+            logger.info('Docstore %s ready' % settings.DOCSTORE_HOST)
+            return
+        except (Exception, SystemExit) as err:
+            logger.error('Docstore %s not available: %s' % (
+                settings.DOCSTORE_HOST, err
+            ))
+        time.sleep(DOCSTORE_PROBE_INTERVAL)
+
+def _docstore():
+    ds = docstore.Docstore(INDEX_PREFIX, settings.DOCSTORE_HOST, settings)
+    threading.Thread(
+        target=_probe_docstore, args=(ds,), name='docstore-probe', daemon=True
+    ).start()
+    return ds
 
 # set default hosts and index
-DOCSTORE = docstore.Docstore(INDEX_PREFIX, settings.DOCSTORE_HOST, settings)
+# Shared by everything in the process, created (and probed in the
+# background) on first use, so importing this module never touches
+# the network.
+DOCSTORE = SimpleLazyObject(_docstore)
 
 MAX_SIZE = 10000
 
 #SEARCH_LIST_FIELDS = models.all_list_fields()
 DEFAULT_LIMIT = 1000
 
+# How often (seconds) each process checks whether its Corpus is stale
+CORPUS_CHECK_INTERVAL = 60
+# Indexes included in the Corpus
+CORPUS_MODELS = ['article', 'author', 'source', 'facetterm']
+# A Corpus built by one process is shared with the others via the cache.
+# Only the process holding the lock rebuilds; the rest serve their
+# previous Corpus until the new one is available.
+CORPUS_KEY = 'encyc-front:corpus:%s'
+CORPUS_LOCK_KEY = 'encyc-front:corpus:lock'
+CORPUS_LOCK_TIMEOUT = 60 * 5
+CORPUS_SHARED_TIMEOUT = 60 * 60
+# Seconds a process with no Corpus at all waits for another to build one
+CORPUS_WAIT = 30
+
+# Prepared article bodies are keyed by modified timestamp
+# so they can be kept much longer than the list caches.
+BODY_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
 # whitelist of params recognized in URL query
 # TODO derive from ddr-defs/repo_models/
 SEARCH_PARAM_WHITELIST = [
@@ -137,6 +184,38 @@ def columnizer(things, cols):
     columns.append(col)
     return columns
 
+# Fields fetched by the get_light() methods: enough to name, link to and
+# cite a document.  Bodies, captions and the rg_* ResourceGuide fields
+# stay in Elasticsearch.
+AUTHOR_LIGHT_FIELDS = [
+    'url_title', 'title', 'title_sort', 'published', 'modified',
+]
+PAGE_LIGHT_FIELDS = [
+    'url_title', 'title', 'title_sort', 'published', 'published_encyc',
+    'modified', 'authors_data', 'categories', 'source_ids',
+]
+SOURCE_LIGHT_FIELDS = [
+    'encyclopedia_id', 'headword', 'caption', 'published', 'created',
+    'modified',
+]
+
+@timing.timed('es')
+def _get_fields(doctype, model, document_id, fields):
+    """Get a document from the docstore with only the named fields
+    
+    @param doctype: Author, Page, or Source
+    @param model: str 'author', 'article', or 'source'
+    @param document_id: str
+    @param fields: list Names of fields to fetch
+    @returns: doctype object
+    @raises: NotFoundError
+    """
+    ds = DOCSTORE
+    return super(doctype, doctype).get(
+        id=document_id, index=ds.index_name(model), using=ds.es,
+        _source_includes=fields,
+    )
+
 def _set_attr(obj, hit, fieldname):
     """Assign a SearchResults Hit value if present
     """
@@ -147,12 +226,41 @@ def _set_attr(obj, hit, fieldname):
 class Author(repo_models.Author):
 
     @staticmethod
+    @timing.timed('es')
     def get(title):
         ds = DOCSTORE
         return super(Author, Author).get(
             title, index=ds.index_name('author'), using=ds.es
     )
 
+    @staticmethod
+    def get_light(title, fields=AUTHOR_LIGHT_FIELDS):
+        """Get an Author with only the named fields (default: no body)
+        
+        @param title: str
+        @param fields: list
+        @returns: Author
+        @raises: NotFoundError
+        """
+        return _get_fields(Author, 'author', title, fields)
+
+    @staticmethod
+    @timing.timed('es')
+    def mget(url_titles, fields=AUTHOR_LIGHT_FIELDS):
+        """Get multiple Authors in one request, in url_titles order
+        
+        Authors that are not in the index are skipped.
+        
+        @param url_titles: list
+        @param fields: list Names of fields to fetch
+        @returns: list
+        """
+        ds = DOCSTORE
+        return super(Author, Author).mget(
+            url_titles, index=ds.index_name('author'), using=ds.es,
+            missing='skip', _source_includes=fields
+        )
+
     def absolute_url(self):
         return reverse('wikiprox-author', args=([self.title,]))
     
@@ -161,11 +269,11 @@ class Author(repo_models.Author):
         
         @returns: list
         """
-        return [
-            page
-            for page in Page.pages()
-            if page.url_title in self.article_titles
-        ]
+        data = corpus()
+        if self.url_title in data.articles_by_author:
+            return data.articles_by_author[self.url_title]
+        # author not in Corpus (e.g. added since it was built)
+        return corpus_.pages_for_titles(data.pages_by_url_title, self.article_titles)
 
     @staticmethod
     def authors():
@@ -173,25 +281,31 @@ class Author(repo_models.Author):
         
         @returns: list
         """
-        KEY = 'encyc-front:authors'
-        data = cache.get(KEY)
-        if not data:
-            searcher = search.Searcher(DOCSTORE)
-            searcher.prepare(
-                params={},
-                params_whitelist=SEARCH_PARAM_WHITELIST,
-                search_models=[DOCSTORE.index_name('author')],
-                sort=[],
-                fields=SEARCH_INCLUDE_FIELDS,
-                fields_nested=[],
-                fields_agg={},
-            )
-            data = sorted([
-                Author.from_hit(hit)
-                for hit in searcher.execute(docstore.MAX_SIZE, 0).objects
-            ])
-            cache.set(KEY, data, settings.CACHE_TIMEOUT)
-        return data
+        return corpus().authors
+
+    @staticmethod
+    def load_authors():
+        """Loads list of published light Author objects from the docstore.
+        
+        Use Author.authors(); this is used to build the Corpus.
+        
+        @returns: list
+        """
+        searcher = search.Searcher(DOCSTORE)
+        searcher.prepare(
+            params={},
+            params_whitelist=SEARCH_PARAM_WHITELIST,
+            search_models=[DOCSTORE.index_name('author')],
+            sort=[],
+            # article_titles for Corpus.articles_by_author
+            fields=SEARCH_INCLUDE_FIELDS + ['article_titles'],
+            fields_nested=[],
+            fields_agg={},
+        )
+        return sorted([
+            Author.from_hit(hit)
+            for hit in searcher.execute(docstore.MAX_SIZE, 0).objects
+        ])
 
     @staticmethod
     def from_hit(hit):
@@ -217,24 +331,66 @@ class Page(repo_models.Page):
     @staticmethod
     def get(title):
         ds = DOCSTORE
-        page = super(Page, Page).get(
-            id=title, index=ds.index_name('article'), using=ds.es
-        )
+        with timing.phase('es'):
+            page = super(Page, Page).get(
+                id=title, index=ds.index_name('article'), using=ds.es
+            )
         # filter out ResourceGuide items
         if not page.published_encyc:
             return None
         page.prepare()
         return page
     
+    @staticmethod
+    def get_light(title, fields=PAGE_LIGHT_FIELDS):
+        """Get a Page with only the named fields (default: no body)
+        
+        For lookups that only need to name or link to a Page.
+        Like Page.get(), returns None for ResourceGuide-only items.
+        The body is not fetched, so it is not prepared either.
+        
+        @param title: str
+        @param fields: list Must include 'published_encyc'
+        @returns: Page or None
+        @raises: NotFoundError
+        """
+        page = _get_fields(Page, 'article', title, fields)
+        if not page.published_encyc:
+            return None
+        return page
+    
+    @timing.timed('prepare')
     def prepare(self):
-        soup = BeautifulSoup(self.body, 'html.parser')
+        """Prepare body for display, using the cached copy if available
+        
+        Prepared bodies are cached by url_title, modified and
+        settings.VERSION, so a body is transformed once per edit (or
+        deploy) rather than once per view.
+        Hits and misses are counted in stats group 'prepared-body'.
+        """
+        # VERSION: a deploy may change how bodies are prepared
+        key = make_cache_key('encyc-front:body:%s:%s:%s' % (
+            settings.VERSION, self.modified, self.url_title
+        ))
+        body = cache.get(key)
+        if body is None:
+            stats.incr('prepared-body', 'misses')
+            body = Page.prepare_body(self.body)
+            cache.set(key, body, BODY_CACHE_TIMEOUT)
+        else:
+            stats.incr('prepared-body', 'hits')
+        self.body = body
+    
+    @staticmethod
+    def prepare_body(body):
+        """Rewrite internal links in article body HTML
+        
+        @param body: str
+        @returns: str
+        """
         # remove `wiki/` from URL
         # append trailing slashes to internal links
-        for a in soup.find_all('a', class_='encyc'):
-            a['href'] = a['href'].replace('/wiki', '')
-            if a['href'][-1] != '/':
-                a['href'] += '/'
-        self.body = soup.prettify()
+        return links.rewrite_links(body)
     
     def absolute_url(self):
         return reverse('wikiprox-page', args=([self.title]))
@@ -242,16 +398,29 @@ class Page(repo_models.Page):
     def authors(self):
         """Returns list of published light Author objects for this Page.
         
-        @returns: list
+        Authors come from the Corpus.  Any that are not in it (e.g. added
+        since it was built) are fetched together in one mget.  Authors
+        that cannot be found are represented by their display names.
+        
+        @returns: list of Authors and/or strs
         """
-        objects = []
-        for url_title in self.authors_data['display']:
-            try:
-                author = Author.get(url_title)
-            except NotFoundError:
-                author = url_title
-            objects.append(author)
-        return objects
+        # memo goes in __dict__: attributes set on a Document are fields
+        if '_authors' not in self.__dict__:
+            url_titles = list(self.authors_data['display'])
+            known = corpus().authors_by_url_title
+            missing = [
+                url_title for url_title in url_titles if url_title not in known
+            ]
+            fetched = {}
+            if missing:
+                fetched = {
+                    author.url_title: author for author in Author.mget(missing)
+                }
+            self.__dict__['_authors'] = [
+                known.get(url_title) or fetched.get(url_title) or url_title
+                for url_title in url_titles
+            ]
+        return self.__dict__['_authors']
     
     @staticmethod
     def pages():
@@ -259,25 +428,30 @@ class Page(repo_models.Page):
         
         @returns: list
         """
-        KEY = 'encyc-front:pages'
-        data = cache.get(KEY)
-        if not data:
-            searcher = search.Searcher(DOCSTORE)
-            searcher.prepare(
-                params={},
-                params_whitelist=SEARCH_PARAM_WHITELIST,
-                search_models=[DOCSTORE.index_name('article')],
-                sort=[],
-                fields=SEARCH_INCLUDE_FIELDS,
-                fields_nested=[],
-                fields_agg={},
-            )
-            data = sorted([
-                Page.from_hit(hit)
-                for hit in searcher.execute(docstore.MAX_SIZE, 0).objects
-            ])
-            cache.set(KEY, data, settings.CACHE_TIMEOUT)
-        return data
+        return corpus().pages
+    
+    @staticmethod
+    def load_pages():
+        """Loads list of published light Page objects from the docstore.
+        
+        Use Page.pages(); this is used to build the Corpus.
+        
+        @returns: list
+        """
+        searcher = search.Searcher(DOCSTORE)
+        searcher.prepare(
+            params={},
+            params_whitelist=SEARCH_PARAM_WHITELIST,
+            search_models=[DOCSTORE.index_name('article')],
+            sort=[],
+            fields=SEARCH_INCLUDE_FIELDS,
+            fields_nested=[],
+            fields_agg={},
+        )
+        return sorted([
+            Page.from_hit(hit)
+            for hit in searcher.execute(docstore.MAX_SIZE, 0).objects
+        ])
     
     @staticmethod
     def from_hit(hit):
@@ -309,66 +483,11 @@ class Page(repo_models.Page):
         
         @returns: list
         """
-        KEY = 'encyc-front:pages_by_category'
-        data = cache.get(KEY)
-        if not data:
-            categories = {}
-            for page in Page.pages():
-                for category in page.categories:
-                    # exclude internal editorial categories
-                    if category not in settings.MEDIAWIKI_HIDDEN_CATEGORIES:
-                        if category not in categories.keys():
-                            categories[category] = []
-                        # pages already sorted so category lists will be sorted
-                        if page not in categories[category]:
-                            categories[category].append(page)
-            categories_list = [
-                (key,categories[key])
-                for key in sorted(categories.keys())
-            ]
-            # cache only the data needed for display
-            data = []
-            while(categories_list):
-                key,pages = categories_list.pop(0)
-                pages_new = [
-                    {
-                        'first_letter': page.title_sort[0].upper(),
-                        'title_sort': page.title_sort,
-                        'title': page.title,
-                        'absolute_url': page.absolute_url(),
-                    }
-                    for page in pages
-                ]
-                data.append((key,pages_new))
-            cache.set(KEY, data, settings.CACHE_TIMEOUT)
-        return data
+        return corpus().pages_by_category
 
     @staticmethod
     def pages_by_initial():
-        KEY = 'encyc-front:pages_by_initial'
-        data = cache.get(KEY)
-        if not data:
-            data = OrderedDict()
-            data['1-10'] = []
-            for c in 'abcdefghijklmnopqrstuvwxyz':
-                data[c] = []
-            for page in Page.pages():
-                initial = page.title_sort[0].lower()
-                if initial.isdigit():
-                    initial = '1-10'
-                p = {
-                    'first_letter': page.title_sort[0].upper(),
-                    'title_sort': page.title_sort,
-                    'title': page.title,
-                    'absolute_url': page.absolute_url(),
-                }
-                data[initial].append(p)
-            for initial,pages in data.items():
-                data[initial] = sorted(
-                    pages, key=lambda page: page['title_sort']
-                )
-            cache.set(KEY, data, settings.CACHE_TIMEOUT)
-        return data
+        return corpus().pages_by_initial
 
     @staticmethod
     def titles():
@@ -376,30 +495,45 @@ class Page(repo_models.Page):
         
         @returns: list
         """
-        KEY = 'encyc-front:page-titles'
-        data = cache.get(KEY)
-        if not data:
-            data = [page.title for page in Page.pages()]
-            cache.set(KEY, data, settings.CACHE_TIMEOUT)
-        return data
+        return corpus().titles
+    
+    @staticmethod
+    def prev_next_index():
+        """Dict of Page title: (previous light Page, next light Page)
+        
+        Built once with Page.pages() so that navigation links are a dict
+        lookup instead of a scan of the titles list plus two Page.get()s.
+        
+        @returns: dict
+        """
+        return corpus().prev_next
     
     def sources(self):
-        """Returns list of published light Source objects for this Page.
+        """Returns list of published Source objects for this Page.
+        
+        Sources are fetched in a single multi-get and memoized on the Page,
+        so templates can call page.sources as often as they like.
+        Order follows Page.source_ids; missing Sources are skipped.
         
         @returns: list
         """
-        try:
-            return [Source.get(sid) for sid in self.source_ids]
-        except NotFoundError:
-            return []
+        # memo goes in __dict__: attributes set on a Document are fields
+        if '_sources' not in self.__dict__:
+            if self.source_ids:
+                self.__dict__['_sources'] = Source.mget(list(self.source_ids))
+            else:
+                self.__dict__['_sources'] = []
+        return self.__dict__['_sources']
     
     def topics(self):
         """List of DDR topics associated with this page.
         
         @returns: list of FacetTerms
         """
+        # copies: terms belong to the Corpus and callers add DDR objects
         return [
-            term for term in FacetTerm.topics_by_url().get(self.title, [])
+            copy.deepcopy(term)
+            for term in FacetTerm.topics_by_url().get(self.title, [])
         ]
     
     def ddr_terms_objects(self, size=100):
@@ -414,32 +548,51 @@ class Page(repo_models.Page):
     def set_prev_next(self):
         """Sets and previous and next page objects
         Don't put in Page.get or lists or you'll get three pages for every one
+        
+        Previous/next are light Pages (title, url_title, etc but no body).
         """
-        # previous,next pages
-        titles = Page.titles()
-        page_index = None
-        for n,title in enumerate(titles):
-            if title == self.title:
-                page_index = n
-        try:
-            self.prev_page = Page.get(titles[page_index-1])
-        except:
-            self.prev_page = None
-        try:
-            self.next_page = Page.get(titles[page_index+1])
-        except:
-            self.next_page = None
+        self.prev_page,self.next_page = Page.prev_next_index().get(
+            self.title, (None,None)
+        )
         return self.prev_page,self.next_page
 
 class Source(repo_models.Source):
 
     @staticmethod
+    @timing.timed('es')
     def get(title):
         ds = DOCSTORE
         return super(Source, Source).get(
             title, index=ds.index_name('source'), using=ds.es
         )
     
+    @staticmethod
+    def get_light(title, fields=SOURCE_LIGHT_FIELDS):
+        """Get a Source with only the named fields
+        
+        @param title: str encyclopedia_id
+        @param fields: list
+        @returns: Source
+        @raises: NotFoundError
+        """
+        return _get_fields(Source, 'source', title, fields)
+    
+    @staticmethod
+    @timing.timed('es')
+    def mget(encyclopedia_ids):
+        """Get multiple Sources in one request, in encyclopedia_ids order
+        
+        Sources that are not in the index are skipped.
+        
+        @param encyclopedia_ids: list
+        @returns: list
+        """
+        ds = DOCSTORE
+        return super(Source, Source).mget(
+            encyclopedia_ids, index=ds.index_name('source'), using=ds.es,
+            missing='skip'
+        )
+    
     def absolute_url(self):
         return reverse('wikiprox-source', args=([self.encyclopedia_id]))
     
@@ -478,9 +631,12 @@ class Source(repo_models.Source):
         return None
     
     def article(self):
+        """Light Page for this Source's headword, or None
+        """
+        page = None
         if self.headword:
             try:
-                page = Page.get(self.headword)
+                page = Page.get_light(self.headword)
             except NotFoundError:
                 page = None
         return page
@@ -491,25 +647,30 @@ class Source(repo_models.Source):
         
         @returns: list
         """
-        KEY = 'encyc-front:sources'
-        data = cache.get(KEY)
-        if not data:
-            searcher = search.Searcher(DOCSTORE)
-            searcher.prepare(
-                params={},
-                params_whitelist=SEARCH_PARAM_WHITELIST,
-                search_models=[DOCSTORE.index_name('source')],
-                sort=[],
-                fields=SEARCH_INCLUDE_FIELDS,
-                fields_nested=[],
-                fields_agg={},
-            )
-            data = sorted([
-                Source.from_hit(hit)
-                for hit in searcher.execute(docstore.MAX_SIZE, 0).objects
-            ])
-            cache.set(KEY, data, settings.CACHE_TIMEOUT)
-        return data
+        return corpus().sources
+    
+    @staticmethod
+    def load_sources():
+        """Loads list of published light Source objects from the docstore.
+        
+        Use Source.sources(); this is used to build the Corpus.
+        
+        @returns: list
+        """
+        searcher = search.Searcher(DOCSTORE)
+        searcher.prepare(
+            params={},
+            params_whitelist=SEARCH_PARAM_WHITELIST,
+            search_models=[DOCSTORE.index_name('source')],
+            sort=[],
+            fields=SEARCH_INCLUDE_FIELDS,
+            fields_nested=[],
+            fields_agg={},
+        )
+        return sorted([
+            Source.from_hit(hit)
+            for hit in searcher.execute(docstore.MAX_SIZE, 0).objects
+        ])
     
     @staticmethod
     def from_hit(hit):
@@ -663,33 +824,196 @@ class FacetTerm(repo_models.FacetTerm):
     def topics_by_url():
         """Dict of ENCYCLOPEDIA_TITLE:[FacetTerm,...]
         """
-        KEY = 'encyc-front:topics_by_url'
-        TIMEOUT = 60*5
-        data = cache.get(KEY)
-        if not data:
-            data = {}
-            for term in FacetTerm.topics():
-                if hasattr(term, 'encyc_urls') and term.encyc_urls:
-                    for url in term.encyc_urls:
-                        # Add URL of DDR topic page
-                        term['ddr_topic_url'] = '%s/%s/' % (
-                            settings.DDR_TOPICS_BASE, term['term_id']
-                        )
-                        # insert into dict by page title
-                        title = url['title']
-                        if not data.get(title, None):
-                            data[title] = []
-                        data[title].append(term)
-            cache.set(KEY, data, TIMEOUT)
-        return data
+        return corpus().topics_by_url
 
     def articles(self):
         """Returns list of published Pages for this topic.
         
         @returns: list
         """
-        return [
-            page
-            for page in Page.pages()
-            if page.url_title in self.article_titles
-        ]
+        return corpus().articles_by_topic.get(self.term_id, [])
+
+
+_corpus = None
+_corpus_checked = 0
+_corpus_pending = None  # generation being built by us or another process
+_corpus_lock = threading.Lock()
+
+def docstore_generation():
+    """Cheap fingerprint of docstore contents
+    
+    Document count and latest modified timestamp of each Corpus index,
+    from a single size=0 aggregation query.
+    
+    @returns: tuple
+    """
+    s = dsl.Search(
+        using=DOCSTORE.es,
+        index=[DOCSTORE.index_name(model) for model in CORPUS_MODELS],
+    ).extra(size=0)
+    s.aggs.bucket(
+        'indices', 'terms', field='_index', size=len(CORPUS_MODELS)
+    ).metric(
+        'modified', 'max', field='modified'
+    )
+    response = s.execute()
+    return tuple(sorted(
+        (bucket.key, bucket.doc_count, bucket.modified.value)
+        for bucket in response.aggregations.indices.buckets
+    ))
+
+def build_corpus(generation):
+    """Load published content from the docstore and build a Corpus
+    
+    Also purges cached renders of documents that have changed.
+    
+    @param generation: tuple from docstore_generation()
+    @returns: Corpus
+    """
+    started = time.monotonic()
+    data = Corpus(
+        generation,
+        pages=Page.load_pages(),
+        authors=Author.load_authors(),
+        sources=Source.load_sources(),
+        terms=FacetTerm.topics(),
+        hidden_categories=settings.MEDIAWIKI_HIDDEN_CATEGORIES,
+        ddr_topics_base=settings.DDR_TOPICS_BASE,
+    )
+    logger.info('built %s in %.2fs' % (data, time.monotonic() - started))
+    # wikiprox.conditional imports this module
+    from wikiprox import conditional
+    # purge every document whose page would now be rendered differently
+    # (e.g. an article whose next page or sources changed),
+    # using the values conditional uses for ETags
+    pagecache.purge_modified('page', {
+        page.url_title: conditional.page_version(page.url_title, data)
+        for page in data.pages
+    })
+    pagecache.purge_modified('author', {
+        author.url_title: conditional.author_version(author.url_title, data)
+        for author in data.authors
+    })
+    pagecache.purge_modified('source', {
+        source.encyclopedia_id: conditional.source_version(
+            source.encyclopedia_id, data
+        )
+        for source in data.sources
+    })
+    return data
+
+def _corpus_key(generation):
+    return CORPUS_KEY % hashlib.sha1(repr(generation).encode('utf-8')).hexdigest()
+
+def _shared_corpus(generation):
+    """Corpus for generation built by some process, or None
+    """
+    return cache.get(_corpus_key(generation))
+
+def _build_shared_corpus(generation):
+    """Build a Corpus, share it via the cache, and release the lock
+    
+    Counted in stats group 'corpus' as 'recomputes'.
+    """
+    try:
+        stats.incr('corpus', 'recomputes')
+        data = build_corpus(generation)
+        cache.set(_corpus_key(generation), data, CORPUS_SHARED_TIMEOUT)
+    finally:
+        cache.delete(CORPUS_LOCK_KEY)
+    return data
+
+def _rebuild_in_background(generation):
+    global _corpus, _corpus_pending
+    try:
+        data = _build_shared_corpus(generation)
+    except Exception as err:
+        logger.error('Could not build corpus: %s' % err)
+        with _corpus_lock:
+            _corpus_pending = None
+        return
+    with _corpus_lock:
+        _corpus = data
+        _corpus_pending = None
+
+def _wait_for_shared_corpus(generation):
+    """Wait up to CORPUS_WAIT seconds for another process's build
+    """
+    waited = 0
+    while waited < CORPUS_WAIT:
+        time.sleep(1)
+        waited += 1
+        data = _shared_corpus(generation)
+        if data:
+            return data
+    return None
+
+def corpus():
+    """Returns this process's Corpus, rebuilding it if content changed
+    
+    The docstore generation is checked at most every CORPUS_CHECK_INTERVAL
+    seconds.  When it changes, only one process (the one that gets
+    CORPUS_LOCK_KEY) loads the docstore, in a background thread, and
+    shares the new Corpus via the cache.  Until it is available every
+    process keeps serving its previous (stale) Corpus.  A process with
+    no Corpus at all waits for the shared one, or builds its own.
+    If the docstore cannot be reached the current Corpus is kept.
+    
+    Counted in stats group 'corpus': 'stale-served', 'recomputes'.
+    
+    @returns: Corpus
+    """
+    global _corpus, _corpus_checked, _corpus_pending
+    now = time.monotonic()
+    if _corpus and (_corpus_pending is None) \
+       and (now - _corpus_checked < CORPUS_CHECK_INTERVAL):
+        return _corpus
+    with _corpus_lock:
+        if _corpus_pending is not None:
+            data = _shared_corpus(_corpus_pending)
+            if data:
+                _corpus = data
+                _corpus_pending = None
+                return _corpus
+            if now - _corpus_checked < CORPUS_CHECK_INTERVAL:
+                stats.incr('corpus', 'stale-served')
+                return _corpus
+            _corpus_pending = None
+        elif _corpus and (now - _corpus_checked < CORPUS_CHECK_INTERVAL):
+            return _corpus
+        try:
+            generation = docstore_generation()
+        except TransportError as err:
+            if not _corpus:
+                raise
+            logger.error('Could not check docstore generation: %s' % err)
+            generation = _corpus.generation
+        _corpus_checked = now
+        if _corpus and (generation == _corpus.generation):
+            return _corpus
+        data = _shared_corpus(generation)
+        if data:
+            _corpus = data
+            return _corpus
+        locked = cache.add(CORPUS_LOCK_KEY, os.getpid(), CORPUS_LOCK_TIMEOUT)
+        if _corpus:
+            # serve stale while the new Corpus is built
+            _corpus_pending = generation
+            if locked:
+                threading.Thread(
+                    target=_rebuild_in_background, args=(generation,),
+                    name='corpus', daemon=True
+                ).start()
+            stats.incr('corpus', 'stale-served')
+            return _corpus
+        if not locked:
+            _corpus = _wait_for_shared_corpus(generation)
+            if _corpus:
+                return _corpus
+            logger.warning('Gave up waiting for shared corpus')
+        if locked:
+            _corpus = _build_shared_corpus(generation)
+        else:
+            stats.incr('corpus', 'recomputes')
+            _corpus = build_corpus(generation)
+    return _corpus
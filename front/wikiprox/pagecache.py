@@ -0,0 +1,177 @@
+"""wikiprox.pagecache -- Full-page cache with per-document purging
+
+Views opt in by naming a tag and (optionally) the URL kwarg that
+identifies the document they render:
+
+    @pagecache.tagged('page', 'url_title')
+    def article(request, url_title, ...):
+
+    @pagecache.tagged('page')
+    def contents(request, ...):
+
+PageCacheMiddleware caches successful GET responses of tagged views for
+CACHE_MIDDLEWARE_SECONDS.  Each entry is stored with the current
+generation of its tag; purging a tag bumps the generation so stale
+entries are never served again.  Views without a kwarg use the
+tag-wide generation ('*'), which is bumped whenever any document with
+that tag is purged.  Tag-wide entries also record the generation of the
+Corpus (wikiprox.models.corpus) they were rendered from: purging happens
+when the new Corpus is built, and processes still serving the previous
+one must not store their renders under the new generation.
+
+Entries are keyed by host and full path (templates may show the host).
+Views can cache a response for less time, or not at all, when it
+depends on the visitor or on a backend that failed:
+
+    pagecache.expire(response, 60)
+
+Hits and misses are counted in stats group 'pagecache'.
+"""
+import hashlib
+import logging
+logger = logging.getLogger(__name__)
+
+from elasticsearch.exceptions import TransportError
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.deprecation import MiddlewareMixin
+
+from wikiprox import make_cache_key
+from wikiprox import stats
+
+ALL = '*'
+ENTRY_KEY = 'encyc-front:pagecache:entry:%s'
+GEN_KEY = 'encyc-front:pagecache:gen:%s:%s'
+MODIFIED_KEY = 'encyc-front:pagecache:modified:%s'
+
+
+def tagged(tag, kwarg=None):
+    """Mark a view as cacheable by PageCacheMiddleware
+
+    Apply outside other decorators so the marker is visible to the
+    middleware.
+
+    @param tag: str e.g. 'page', 'author', 'source'
+    @param kwarg: str URL kwarg holding the document ID, or None
+    """
+    def decorator(view_func):
+        view_func.pagecache_tag = (tag, kwarg)
+        return view_func
+    return decorator
+
+def _normalize(value):
+    # wikiprox.views.article accepts underscores in place of spaces
+    return str(value).replace('_', ' ')
+
+def _gen_key(tag, value):
+    return make_cache_key(GEN_KEY % (tag, _normalize(value)))
+
+def _entry_key(request):
+    url = '%s://%s%s' % (
+        request.scheme, request.get_host(), request.get_full_path()
+    )
+    return ENTRY_KEY % hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+def _corpus_generation():
+    # wikiprox.models imports this module
+    from wikiprox import models
+    return models.corpus().generation
+
+def expire(response, seconds):
+    """Cache response for at most seconds (0: don't cache it)
+
+    @param response: HttpResponse
+    @param seconds: int
+    @returns: HttpResponse
+    """
+    response.pagecache_seconds = min(
+        seconds, getattr(response, 'pagecache_seconds', seconds)
+    )
+    return response
+
+def purge(tag, value=ALL):
+    """Invalidate cached renders for a document (or a whole tag)
+
+    @param tag: str
+    @param value: str Document ID or pagecache.ALL
+    """
+    key = _gen_key(tag, value)
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+def purge_modified(tag, modified):
+    """Purge documents whose version changed since last call
+
+    Compares against the {id: version} seen on the previous call.
+    A version is any picklable value that changes whenever the
+    document's page would, e.g. its modified timestamp.
+    If anything changed (including additions and removals) the tag-wide
+    generation is bumped as well, so list views are refreshed.
+
+    @param tag: str
+    @param modified: dict {document_id: version}
+    @returns: list of changed document IDs
+    """
+    key = MODIFIED_KEY % tag
+    previous = cache.get(key)
+    cache.set(key, modified, None)
+    if previous is None:
+        return []
+    changed = [
+        doc_id for doc_id in set(previous.keys()) | set(modified.keys())
+        if previous.get(doc_id) != modified.get(doc_id)
+    ]
+    for doc_id in changed:
+        purge(tag, doc_id)
+    if changed:
+        purge(tag, ALL)
+        logger.info('pagecache purged %s %s' % (len(changed), tag))
+    return changed
+
+
+class PageCacheMiddleware(MiddlewareMixin):
+    """Serve and store renders of views marked with pagecache.tagged
+    """
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        tag = getattr(view_func, 'pagecache_tag', None)
+        if (not tag) or (request.method != 'GET'):
+            return None
+        tag,kwarg = tag
+        value = ALL
+        if kwarg:
+            value = view_kwargs.get(kwarg, ALL)
+        entry_key = _entry_key(request)
+        gen_key = _gen_key(tag, value)
+        cached = cache.get_many([entry_key, gen_key])
+        gen = cached.get(gen_key, 0)
+        if value == ALL:
+            try:
+                gen = (gen, _corpus_generation())
+            except TransportError:
+                return None
+        entry = cached.get(entry_key)
+        if entry and (entry[0] == gen):
+            stats.incr('pagecache', 'hits')
+            return entry[1]
+        stats.incr('pagecache', 'misses')
+        request._pagecache = (entry_key, gen)
+        return None
+
+    def process_response(self, request, response):
+        if not getattr(request, '_pagecache', None):
+            return response
+        if (response.status_code != 200) or response.streaming:
+            return response
+        seconds = getattr(
+            response, 'pagecache_seconds', settings.CACHE_MIDDLEWARE_SECONDS
+        )
+        if seconds <= 0:
+            return response
+        entry_key,gen = request._pagecache
+        cache.set(entry_key, (gen, response), seconds)
+        return response
@@ -0,0 +1,135 @@
+"""wikiprox.pagination -- Paging and streaming of Corpus lists for the API
+
+List endpoints take one of:
+
+    ?limit=N&offset=M    Classic limit/offset paging.
+    ?limit=N&cursor=     Cursor paging.  Follow the "next" link.  Cursors
+                         point at a position in title_sort order rather than
+                         an index, so they stay valid when the Corpus is
+                         rebuilt between requests.
+    (nothing)            The whole list.  JSON is streamed in chunks
+                         so large dumps are not built in memory first.
+
+Objects must be sorted, with sort_keys the matching list of sort keys
+(see Corpus.page_keys, Corpus.author_keys).
+"""
+import base64
+from bisect import bisect_left
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+DEFAULT_LIMIT = settings.REST_FRAMEWORK.get('PAGE_SIZE', 20)
+MAX_LIMIT = 1000
+# Rows serialized per chunk of a streamed response
+STREAM_CHUNK = 500
+
+
+def respond(request, objects, sort_keys, row):
+    """API response for a list of objects, paged or streamed per request
+
+    @param request: rest_framework.request.Request
+    @param objects: list Sorted objects
+    @param sort_keys: list Sort key of each object
+    @param row: function Returns the data for one object
+    @returns: Response or StreamingHttpResponse
+    """
+    params = request.query_params
+    if not any(key in params for key in ['limit', 'offset', 'cursor']):
+        if request.accepted_renderer.format == 'json':
+            return stream_json(objects, row)
+        return Response([row(o) for o in objects])
+    try:
+        limit = min(int(params.get('limit', DEFAULT_LIMIT)), MAX_LIMIT)
+        if 'cursor' in params:
+            offset = cursor_offset(sort_keys, params['cursor'])
+        else:
+            offset = int(params.get('offset', 0))
+    except ValueError:
+        return Response(status=status.HTTP_400_BAD_REQUEST)
+    if (limit < 1) or (offset < 0):
+        return Response(status=status.HTTP_400_BAD_REQUEST)
+    end = offset + limit
+    url = request.build_absolute_uri()
+    next_url = None
+    previous_url = None
+    if 'cursor' in params:
+        if end < len(objects):
+            next_url = replace_query_param(
+                url, 'cursor', make_cursor(sort_keys, end)
+            )
+    else:
+        if end < len(objects):
+            next_url = replace_query_param(url, 'offset', end)
+        if offset > 0:
+            if offset - limit > 0:
+                previous_url = replace_query_param(url, 'offset', offset - limit)
+            else:
+                previous_url = remove_query_param(url, 'offset')
+    return Response(OrderedDict(
+        count=len(objects),
+        next=next_url,
+        previous=previous_url,
+        results=[row(o) for o in objects[offset:end]],
+    ))
+
+def make_cursor(sort_keys, index):
+    """Opaque cursor for the object at index
+
+    Encodes the sort key and how many objects with that same key come
+    before it.
+
+    @param sort_keys: list
+    @param index: int
+    @returns: str
+    """
+    key = sort_keys[index]
+    position = [key, index - bisect_left(sort_keys, key)]
+    return base64.urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('ascii')
+
+def cursor_offset(sort_keys, cursor):
+    """Index in sort_keys that a cursor points to
+
+    An empty cursor means the start of the list.
+
+    @param sort_keys: list
+    @param cursor: str
+    @returns: int
+    @raises: ValueError if cursor is not valid
+    """
+    if not cursor:
+        return 0
+    try:
+        key,n = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if not isinstance(key, str) or isinstance(n, bool) \
+           or not isinstance(n, int) or (n < 0):
+            raise ValueError
+    except Exception:
+        raise ValueError('Bad cursor: %s' % cursor)
+    return bisect_left(sort_keys, key) + n
+
+def stream_json(objects, row):
+    """JSON array of row(o) for all objects, serialized as it is sent
+
+    @param objects: list
+    @param row: function
+    @returns: StreamingHttpResponse
+    """
+    def chunks():
+        encoder = JSONEncoder()
+        yield '['
+        for n in range(0, len(objects), STREAM_CHUNK):
+            if n:
+                yield ','
+            yield ','.join(
+                encoder.encode(row(o)) for o in objects[n:n+STREAM_CHUNK]
+            )
+        yield ']'
+    return StreamingHttpResponse(chunks(), content_type='application/json')
@@ -1,36 +1,127 @@
-from datetime import datetime
+"""wikiprox.sitemaps -- sitemap.xml for pages, authors and sources
+
+/sitemap.xml is a sitemap index pointing to one sitemap per section
+(/sitemap-pages.xml etc).  Sections with more than Sitemap.limit
+(50,000) URLs are split into numbered pages (?p=2) by Django.
+
+Items come from the in-process Corpus.  Rendered XML is cached, keyed by
+each section's size and latest modified date, so a section is only
+regenerated when one of its documents changes.
+"""
+import hashlib
 
-from django.conf import settings
 from django.contrib.sitemaps import Sitemap
-from rest_framework.reverse import reverse
+from django.contrib.sitemaps import views as sitemap_views
+from django.core.cache import cache
+from django.http import Http404
 
+from wikiprox import make_cache_key
 from wikiprox import models
+from wikiprox.api import url_template
+from wikiprox.conditional import to_datetime
 
+SITEMAP_KEY = 'encyc-front:sitemap:%s'
+SITEMAP_CACHE_TIMEOUT = 60 * 60 * 24 * 7
 
-class Item(object):
-    location = ''
-    timestamp = None
-    
-    def unicode(self):
-        self.title
-    
-    def get_absolute_url(self):
-        return self.location
 
+class CorpusSitemap(Sitemap):
+    """Sitemap of one list of documents in the Corpus
+    """
+    changefreq = 'weekly'
+    corpus_attr = None    # Corpus list of documents
+    modified_attr = None  # Corpus latest modified value of the list
+    viewname = None       # URL name of the document's page
+    url_arg = None        # document field to put in the URL
 
-class PageSitemap(Sitemap):
-    changefreq = "weekly"
-    priority = 0.8
-    
     def items(self):
-        items = []
-        for page in models.Page.pages():
-            item = Item()
-            item.title = page.title
-            item.location = f"/{page.url_title}"
-            item.timestamp = page.modified
-            items.append(item)
-        return items
-    
+        return getattr(models.corpus(), self.corpus_attr)
+
+    def location(self, obj):
+        if not hasattr(self, '_url'):
+            self._url = url_template(self.viewname)
+        return self._url(getattr(obj, self.url_arg))
+
     def lastmod(self, obj):
-        return obj.timestamp
+        return to_datetime(getattr(obj, 'modified', None))
+
+    def get_latest_lastmod(self):
+        return to_datetime(getattr(models.corpus(), self.modified_attr))
+
+    def version(self, corpus):
+        """Changes when the section's contents change
+
+        @param corpus: Corpus
+        @returns: tuple
+        """
+        return (
+            len(getattr(corpus, self.corpus_attr)),
+            str(getattr(corpus, self.modified_attr)),
+        )
+
+
+class PageSitemap(CorpusSitemap):
+    priority = 0.8
+    corpus_attr = 'pages'
+    modified_attr = 'pages_modified'
+    viewname = 'wikiprox-page'
+    url_arg = 'url_title'
+
+
+class AuthorSitemap(CorpusSitemap):
+    priority = 0.5
+    corpus_attr = 'authors'
+    modified_attr = 'authors_modified'
+    viewname = 'wikiprox-author'
+    url_arg = 'url_title'
+
+
+class SourceSitemap(CorpusSitemap):
+    priority = 0.3
+    corpus_attr = 'sources'
+    modified_attr = 'sources_modified'
+    viewname = 'wikiprox-source'
+    url_arg = 'encyclopedia_id'
+
+
+def _cached(request, name, sections, view, *args, **kwargs):
+    """Render view, or return the rendering cached for these versions
+
+    @param request: HttpRequest
+    @param name: str 'index' or section name
+    @param sections: list of CorpusSitemap classes the output depends on
+    @param view: django.contrib.sitemaps view
+    @returns: HttpResponse
+    """
+    corpus = models.corpus()
+    key = make_cache_key(SITEMAP_KEY % hashlib.sha1(repr((
+        name,
+        request.scheme,
+        request.get_host(),
+        request.GET.get('p'),
+        [section().version(corpus) for section in sections],
+    )).encode('utf-8')).hexdigest())
+    response = cache.get(key)
+    if response is None:
+        response = view(request, *args, **kwargs)
+        response.render()
+        if response.status_code == 200:
+            cache.set(key, response, SITEMAP_CACHE_TIMEOUT)
+    return response
+
+def index(request, sitemaps, sitemap_url_name='wikiprox-sitemap-section'):
+    """Sitemap index listing each section (and page of a section)
+    """
+    return _cached(
+        request, 'index', sitemaps.values(),
+        sitemap_views.index, sitemaps, sitemap_url_name=sitemap_url_name,
+    )
+
+def section(request, sitemaps, section):
+    """Sitemap for one section
+    """
+    if section not in sitemaps:
+        raise Http404('No sitemap available for section: %r' % section)
+    return _cached(
+        request, section, [sitemaps[section]],
+        sitemap_views.sitemap, sitemaps, section=section,
+    )
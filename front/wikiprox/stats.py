@@ -0,0 +1,65 @@
+"""wikiprox.stats -- Counters kept in the Django cache
+
+Counters are shared by all worker processes and never expire.
+Read them from `python manage.py shell`:
+
+    >>> from wikiprox import stats
+    >>> stats.read('prepared-body')
+    {'hits': 1234, 'misses': 56}
+"""
+from django.core.cache import cache
+
+from wikiprox import make_cache_key
+
+KEY = 'encyc-front:stats:%s:%s'
+DEFAULT_NAMES = ['hits', 'misses']
+
+
+def _key(group, name):
+    return make_cache_key(KEY % (group, name))
+
+def incr(group, name, delta=1):
+    """Increment a counter, creating it if necessary.
+
+    @param group: str Counter group e.g. 'prepared-body'
+    @param name: str Counter name e.g. 'hits'
+    @param delta: int
+    """
+    key = _key(group, name)
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # counter does not exist yet
+        if not cache.add(key, delta, None):
+            cache.incr(key, delta)
+
+def read(group, names=DEFAULT_NAMES):
+    """Read counters in a group.
+
+    @param group: str
+    @param names: list
+    @returns: dict of name: int
+    """
+    keys = {_key(group, name): name for name in names}
+    values = cache.get_many(list(keys.keys()))
+    return {name: values.get(key, 0) for key,name in keys.items()}
+
+def hit_rate(group):
+    """Ratio of hits to hits+misses in a group, or None if no data.
+
+    @param group: str
+    @returns: float or None
+    """
+    counts = read(group)
+    total = counts['hits'] + counts['misses']
+    if not total:
+        return None
+    return counts['hits'] / total
+
+def reset(group, names=DEFAULT_NAMES):
+    """Reset counters in a group.
+
+    @param group: str
+    @param names: list
+    """
+    cache.delete_many([_key(group, name) for name in names])
@@ -1,6 +1,7 @@
 from django import template
 from django.conf import settings
 
+from wikiprox import fragments
 from wikiprox.sources import format_primary_source
 
 
@@ -17,7 +18,11 @@ class PrimarySourceNode(template.Node):
             lightbox = self.lightbox
         except template.VariableDoesNotExist as err:
             return '<!-- {{ err }} -->'
-        return format_primary_source(primarysource, lightbox)
+        return fragments.cached(
+            'primarysource',
+            [primarysource.encyclopedia_id, primarysource.modified, lightbox],
+            lambda: format_primary_source(primarysource, lightbox)
+        )
 
 def do_primarysource(parser, token):
     """Render a Source using a templatetag.
@@ -49,12 +54,19 @@ register.tag('primarysource_lightbox', do_primarysource_lightbox)
 def ddrobject( page, obj ):
     """DDR object in sidebar
     """
-    t = template.loader.get_template('wikiprox/ddr-object.html')
-    return t.render({
-        'page': page,
-        'object': obj,
-        'MEDIA_URL': settings.MEDIA_URL,
-        'DDR_MEDIA_URL': settings.DDR_MEDIA_URL,
-    })
+    def render():
+        t = template.loader.get_template('wikiprox/ddr-object.html')
+        return t.render({
+            'page': page,
+            'object': obj,
+            'MEDIA_URL': settings.MEDIA_URL,
+            'DDR_MEDIA_URL': settings.DDR_MEDIA_URL,
+        })
+    # key on everything ddr-object.html uses
+    return fragments.cached('ddrobject', [
+        obj.get('id'), page.title,
+        obj.get('title'), obj.get('img_url'), obj.get('img_url_local'),
+        obj.get('img_path'),
+    ], render, fallback=lambda html: 'ddr_img_empty' in html)
 
 register.simple_tag(ddrobject)
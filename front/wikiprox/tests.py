@@ -1,6 +1,28 @@
-from django.test import TestCase
+import base64
+from datetime import datetime
+import json
+import threading
+import time
+
+from elasticsearch.exceptions import TransportError
+
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
 from django.urls import reverse
 
+from wikiprox import api
+from wikiprox import conditional
+from wikiprox import corpus as corpus_
+from wikiprox import ddr
+from wikiprox import fragments
+from wikiprox import links
+from wikiprox import models
+from wikiprox import pagecache
+from wikiprox import timing
+from wikiprox.management.commands import export_static
+from wikiprox.management.commands import warm_cache
+
 
 class APIView(TestCase):
 
@@ -14,11 +36,26 @@ class APIView(TestCase):
         data = {'offset': 25}
         response = self.client.get(reverse('wikiprox-api-articles'), data)
         assert response.status_code == 200
+        assert len(response.data['results']) <= 20
+        data = {'limit': 5, 'cursor': ''}
+        response = self.client.get(reverse('wikiprox-api-articles'), data)
+        assert response.status_code == 200
+        assert len(response.data['results']) == 5
+        assert self.client.get(response.data['next']).status_code == 200
+        # decodable but not a cursor
+        for position in [[1, 2], [None, 0], ['a', -1]]:
+            cursor = base64.urlsafe_b64encode(json.dumps(position).encode('utf-8'))
+            data = {'limit': 5, 'cursor': cursor.decode('ascii')}
+            response = self.client.get(reverse('wikiprox-api-articles'), data)
+            assert response.status_code == 400
 
     def test_article(self):
+        url = reverse('wikiprox-api-page', args=['Ansel Adams'])
+        response = self.client.get(url)
+        assert response.status_code == 200
         assert self.client.get(
-            reverse('wikiprox-api-page', args=['Ansel Adams'])
-        ).status_code == 200
+            url, HTTP_IF_NONE_MATCH=response['ETag']
+        ).status_code == 304
 
     def test_authors(self):
         data = {}
@@ -27,11 +64,40 @@ class APIView(TestCase):
         data = {'offset': 25}
         response = self.client.get(reverse('wikiprox-api-authors'), data)
         assert response.status_code == 200
+        assert len(response.data['results']) <= 20
+        data = {'limit': 5, 'cursor': ''}
+        response = self.client.get(reverse('wikiprox-api-authors'), data)
+        assert response.status_code == 200
+        assert len(response.data['results']) == 5
+        assert self.client.get(response.data['next']).status_code == 200
 
     def test_author(self):
+        url = reverse('wikiprox-api-author', args=['Brian Niiya'])
+        response = self.client.get(url)
+        assert response.status_code == 200
         assert self.client.get(
-            reverse('wikiprox-api-author', args=['Brian Niiya'])
-        ).status_code == 200
+            url, HTTP_IF_NONE_MATCH=response['ETag']
+        ).status_code == 304
+
+    def test_categories(self):
+        response = self.client.get(reverse('wikiprox-api-categories'))
+        assert response.status_code == 200
+        response = self.client.get(
+            reverse('wikiprox-api-categories'),
+            HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        assert response.status_code == 304
+
+    def test_category(self):
+        data = {'limit': 5, 'offset': 5}
+        response = self.client.get(
+            reverse('wikiprox-api-category', args=['Camps']), data
+        )
+        assert response.status_code == 200
+        assert len(response.data['results']) == 5
+        assert self.client.get(
+            reverse('wikiprox-api-category', args=['NotACategory'])
+        ).status_code == 404
 
     #def test_sources(self):
     #    # can't browse sources independent of articles
@@ -43,9 +109,423 @@ class APIView(TestCase):
     #    assert response.status_code == 200
 
     def test_source(self):
+        url = reverse('wikiprox-api-source', args=['en-littletokyousa-1'])
+        response = self.client.get(url)
+        assert response.status_code == 200
         assert self.client.get(
-            reverse('wikiprox-api-source', args=['en-littletokyousa-1'])
-        ).status_code == 200
+            url, HTTP_IF_NONE_MATCH=response['ETag']
+        ).status_code == 304
+
+
+class LightDocuments(TestCase):
+
+    def test_page_get_light(self):
+        page = models.Page.get_light('Ansel Adams')
+        assert page.title == 'Ansel Adams'
+        assert not page.body
+
+    def test_page_authors(self):
+        page = models.Page.get_light('Ansel Adams')
+        authors = page.authors()
+        assert len(authors) == len(page.authors_data['display'])
+        assert authors is page.authors()
+
+    def test_page_sources_memo(self):
+        page = models.Page(meta={'id': 'Test'}, source_ids=[])
+        assert page.sources() is page.sources()
+        assert '_sources' not in page.to_dict()
+
+    def test_source_article(self):
+        source = models.Source.get_light('en-littletokyousa-1')
+        assert source.article().title == source.headword
+
+
+class SyntheticDocument():
+    """Just enough of a light Page or Author to build a Corpus
+    """
+    def __init__(self, title, categories=[], article_titles=[], source_ids=[]):
+        self.title = title
+        self.url_title = title
+        self.title_sort = title.lower()
+        self.categories = categories
+        self.article_titles = article_titles
+        self.source_ids = source_ids
+        self.modified = '2020-01-01T00:00:00'
+
+    def __lt__(self, other):
+        return self.title_sort < other.title_sort
+
+    def absolute_url(self):
+        return '/%s' % self.url_title
+
+
+class CorpusTests(TestCase):
+    """Corpus indexes, built without Elasticsearch
+    """
+
+    def setUp(self):
+        self.pages = sorted([
+            SyntheticDocument('Ansel Adams', ['Arts', 'Hidden']),
+            SyntheticDocument('Manzanar', ['Camps', 'Arts']),
+            SyntheticDocument('Tule Lake', ['Camps']),
+        ])
+        self.authors = [
+            SyntheticDocument('Brian Niiya', article_titles=['Tule Lake', 'Ansel Adams', 'Missing']),
+        ]
+        self.corpus = corpus_.Corpus(
+            'test', self.pages, self.authors, [], [], hidden_categories=['Hidden']
+        )
+
+    def test_articles_by_author(self):
+        articles = self.corpus.articles_by_author['Brian Niiya']
+        assert [page.title for page in articles] == ['Ansel Adams', 'Tule Lake']
+
+    def test_by_category(self):
+        assert self.corpus.category_names == ['Arts', 'Camps']
+        assert [
+            page['title'] for page in self.corpus.category_index['Camps']
+        ] == ['Manzanar', 'Tule Lake']
+
+    def test_prev_next(self):
+        prev_page,next_page = self.corpus.prev_next['Manzanar']
+        assert prev_page.title == 'Ansel Adams'
+        assert next_page.title == 'Tule Lake'
+        assert self.corpus.prev_next['Ansel Adams'][0] is None
+        assert self.corpus.prev_next['Tule Lake'][1] is None
+
+    def test_page_version(self):
+        # an article's version changes with its neighbours' titles
+        pages = sorted(self.pages + [SyntheticDocument('Minidoka')])
+        data = corpus_.Corpus('test2', pages, self.authors, [], [])
+        assert conditional.page_version('Manzanar', self.corpus) \
+            != conditional.page_version('Manzanar', data)
+        assert conditional.page_version('Ansel Adams', self.corpus) \
+            == conditional.page_version('Ansel Adams', data)
+        assert conditional.page_version('Minidoka', self.corpus) is None
+
+
+LOCMEM = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCMEM)
+class PageCache(TestCase):
+    """wikiprox.pagecache, without Elasticsearch
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.middleware = pagecache.PageCacheMiddleware(lambda request: None)
+        self.view = pagecache.tagged('page', 'url_title')(lambda request: None)
+
+    def get(self, path, url_title, status=200):
+        """Response from the page cache, or the one the view would return
+        """
+        request = self.factory.get(path)
+        cached = self.middleware.process_view(
+            request, self.view, [], {'url_title': url_title}
+        )
+        if cached:
+            return cached
+        return self.middleware.process_response(
+            request, HttpResponse(path, status=status)
+        )
+
+    def test_miss_then_hit(self):
+        request = self.factory.get('/Ansel Adams/')
+        assert self.middleware.process_view(
+            request, self.view, [], {'url_title': 'Ansel Adams'}
+        ) is None
+        self.get('/Ansel Adams/', 'Ansel Adams')
+        request = self.factory.get('/Ansel Adams/')
+        cached = self.middleware.process_view(
+            request, self.view, [], {'url_title': 'Ansel Adams'}
+        )
+        assert cached.content == b'/Ansel Adams/'
+
+    def test_bypass(self):
+        # untagged views, non-GET requests and errors are not cached
+        request = self.factory.get('/about/')
+        assert self.middleware.process_view(
+            request, lambda request: None, [], {}
+        ) is None
+        assert not getattr(request, '_pagecache', None)
+        request = self.factory.post('/Ansel Adams/')
+        assert self.middleware.process_view(
+            request, self.view, [], {'url_title': 'Ansel Adams'}
+        ) is None
+        self.get('/Manzanar/', 'Manzanar', status=404)
+        request = self.factory.get('/Manzanar/')
+        assert self.middleware.process_view(
+            request, self.view, [], {'url_title': 'Manzanar'}
+        ) is None
+
+    def test_host(self):
+        self.get('/Ansel Adams/', 'Ansel Adams')
+        request = self.factory.get('/Ansel Adams/', HTTP_HOST='other.testserver')
+        with self.settings(ALLOWED_HOSTS=['testserver', 'other.testserver']):
+            assert self.middleware.process_view(
+                request, self.view, [], {'url_title': 'Ansel Adams'}
+            ) is None
+
+    def test_expire(self):
+        request = self.factory.get('/sources/en-1/')
+        self.middleware.process_view(
+            request, self.view, [], {'url_title': 'en-1'}
+        )
+        self.middleware.process_response(
+            request, pagecache.expire(HttpResponse('referer'), 0)
+        )
+        request = self.factory.get('/sources/en-1/')
+        assert self.middleware.process_view(
+            request, self.view, [], {'url_title': 'en-1'}
+        ) is None
+
+    def test_purge(self):
+        self.get('/Ansel Adams/', 'Ansel Adams')
+        self.get('/Manzanar/', 'Manzanar')
+        # underscores are normalized like wikiprox.views.article does
+        pagecache.purge('page', 'Ansel_Adams')
+        request = self.factory.get('/Ansel Adams/')
+        assert self.middleware.process_view(
+            request, self.view, [], {'url_title': 'Ansel Adams'}
+        ) is None
+        request = self.factory.get('/Manzanar/')
+        assert self.middleware.process_view(
+            request, self.view, [], {'url_title': 'Manzanar'}
+        ) is not None
+
+    def test_tag_wide_corpus_generation(self):
+        # list pages rendered from a stale Corpus are not served
+        # once this process has the new one
+        saved = pagecache._corpus_generation
+        generation = ['gen1']
+        pagecache._corpus_generation = lambda: generation[0]
+        try:
+            self.view = pagecache.tagged('page')(lambda request: None)
+            self.get('/contents/', None)
+            request = self.factory.get('/contents/')
+            assert self.middleware.process_view(request, self.view, [], {})
+            generation[0] = 'gen2'
+            request = self.factory.get('/contents/')
+            assert self.middleware.process_view(
+                request, self.view, [], {}
+            ) is None
+        finally:
+            pagecache._corpus_generation = saved
+
+    def test_purge_modified(self):
+        assert pagecache.purge_modified('page', {'A': 1, 'B': 1}) == []
+        assert pagecache.purge_modified('page', {'A': 1, 'B': 1}) == []
+        all_gen = cache.get(pagecache._gen_key('page', pagecache.ALL), 0)
+        changed = pagecache.purge_modified('page', {'A': 2, 'C': 1})
+        assert sorted(changed) == ['A', 'B', 'C']
+        assert cache.get(pagecache._gen_key('page', 'A')) == 1
+        assert cache.get(pagecache._gen_key('page', pagecache.ALL)) == all_gen + 1
+
+
+@override_settings(CACHES=LOCMEM)
+class SharedCorpus(TestCase):
+    """models.corpus() locking, serve-stale and shared snapshots
+    
+    The docstore is replaced by a generation the test sets and a
+    build_corpus() that records its calls.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.saved = (
+            models.docstore_generation, models.build_corpus,
+            models._corpus, models._corpus_checked, models._corpus_pending,
+        )
+        self.generation = 'gen1'
+        self.builds = []
+        def docstore_generation():
+            if isinstance(self.generation, Exception):
+                raise self.generation
+            return self.generation
+        def build_corpus(generation):
+            self.builds.append(generation)
+            return corpus_.Corpus(generation, [], [], [], [])
+        models.docstore_generation = docstore_generation
+        models.build_corpus = build_corpus
+        models._corpus = None
+        models._corpus_checked = 0
+        models._corpus_pending = None
+
+    def tearDown(self):
+        self.join_builds()
+        (
+            models.docstore_generation, models.build_corpus,
+            models._corpus, models._corpus_checked, models._corpus_pending,
+        ) = self.saved
+
+    def join_builds(self):
+        for thread in threading.enumerate():
+            if thread.name == 'corpus':
+                thread.join()
+
+    def expire_check(self):
+        models._corpus_checked -= models.CORPUS_CHECK_INTERVAL + 1
+
+    def test_cold_start(self):
+        data = models.corpus()
+        assert data.generation == 'gen1'
+        assert self.builds == ['gen1']
+        # shared with other processes, lock released
+        assert models._shared_corpus('gen1').generation == 'gen1'
+        assert cache.get(models.CORPUS_LOCK_KEY) is None
+        # not checked again until CORPUS_CHECK_INTERVAL
+        self.generation = 'gen2'
+        assert models.corpus() is data
+
+    def test_adopt_shared(self):
+        cache.set(models._corpus_key('gen1'), corpus_.Corpus('gen1', [], [], [], []))
+        assert models.corpus().generation == 'gen1'
+        assert self.builds == []
+
+    def test_stale_while_rebuilding(self):
+        old = models.corpus()
+        self.generation = 'gen2'
+        self.expire_check()
+        # old Corpus served while this process rebuilds in the background
+        assert models.corpus() is old
+        self.join_builds()
+        assert self.builds == ['gen1', 'gen2']
+        assert models.corpus().generation == 'gen2'
+
+    def test_stale_while_other_process_rebuilds(self):
+        old = models.corpus()
+        self.generation = 'gen2'
+        self.expire_check()
+        cache.add(models.CORPUS_LOCK_KEY, 'other', models.CORPUS_LOCK_TIMEOUT)
+        assert models.corpus() is old
+        assert models._corpus_pending == 'gen2'
+        assert self.builds == ['gen1']
+        # the other process shares its build
+        cache.set(models._corpus_key('gen2'), corpus_.Corpus('gen2', [], [], [], []))
+        assert models.corpus().generation == 'gen2'
+        assert self.builds == ['gen1']
+
+    def test_docstore_down(self):
+        old = models.corpus()
+        self.generation = TransportError('N/A', 'refused')
+        self.expire_check()
+        assert models.corpus() is old
+
+
+class Sitemaps(TestCase):
+
+    def test_sitemap_index(self):
+        response = self.client.get(reverse('wikiprox-sitemap'))
+        assert response.status_code == 200
+        assert b'sitemap-pages.xml' in response.content
+
+    def test_sitemap_section(self):
+        for section in ['pages', 'authors', 'sources']:
+            assert self.client.get(
+                reverse('wikiprox-sitemap-section', args=[section])
+            ).status_code == 200
+        assert self.client.get(
+            reverse('wikiprox-sitemap-section', args=['nope'])
+        ).status_code == 404
+
+
+class Fragments(TestCase):
+
+    def test_cached(self):
+        calls = []
+        def render():
+            calls.append(1)
+            return '<b>fragment</b>'
+        parts = ['test', datetime.now().isoformat()]
+        assert fragments.cached('test', parts, render) == '<b>fragment</b>'
+        assert fragments.cached('test', parts, render) == '<b>fragment</b>'
+        assert len(calls) == 1
+        assert fragments.timings('test')['hits'] >= 1
+
+    def test_cached_fallback(self):
+        # fallback renders are cached for FALLBACK_TIMEOUT (here: not at all)
+        calls = []
+        def render():
+            calls.append(1)
+            return '<img class="ddr_img_empty">'
+        parts = ['test-fallback', datetime.now().isoformat()]
+        timeout = fragments.FALLBACK_TIMEOUT
+        fragments.FALLBACK_TIMEOUT = 0
+        try:
+            for _ in range(2):
+                fragments.cached('test', parts, render, fallback=lambda html: True)
+        finally:
+            fragments.FALLBACK_TIMEOUT = timeout
+        assert len(calls) == 2
+
+
+class DDRTerms(TestCase):
+
+    def test_term_documents_sliced(self):
+        # cached entries serve any smaller size without calling the API
+        term_id = 'test-%s' % datetime.now().timestamp()
+        cache.set(ddr._term_key(term_id), json.dumps({
+            'size': 100,
+            'fetched': time.time(),
+            'objects': [{'id': n} for n in range(100)],
+        }))
+        assert len(ddr._term_documents(term_id, 10)) == 10
+        assert len(ddr._term_documents(term_id, 100)) == 100
+
+    def test_term_documents_complete(self):
+        # a term with fewer objects than were asked for has no more
+        term_id = 'test-%s' % datetime.now().timestamp()
+        cache.set(ddr._term_key(term_id), json.dumps({
+            'size': 100,
+            'fetched': time.time(),
+            'objects': [{'id': n} for n in range(3)],
+        }))
+        assert len(ddr._term_documents(term_id, 500)) == 3
+
+
+class WarmCache(TestCase):
+
+    def test_warm_urls(self):
+        urls = warm_cache.warm_urls()
+        assert reverse('wikiprox-page', args=['Ansel Adams']) in urls
+        assert reverse('wikiprox-contents') in urls
+        # nothing is modified in the future
+        since = datetime(2100, 1, 1)
+        urls = warm_cache.warm_urls(since)
+        assert reverse('wikiprox-page', args=['Ansel Adams']) not in urls
+
+
+class ExportStatic(TestCase):
+
+    def test_export_versions(self):
+        versions = export_static.export_versions()
+        assert reverse('wikiprox-page', args=['Ansel Adams']) + '/' in versions
+        assert reverse('wikiprox-contents') in versions
+
+    def test_export_filename(self):
+        assert export_static.export_filename('/tmp/html', '/Nisei%2FKibei%3F/') \
+            == '/tmp/html/Nisei/Kibei?/index.html'
+
+
+class Timing(TestCase):
+
+    def test_server_timing(self):
+        header = timing.server_timing({'es': [0.0121, 3]}, 0.0482)
+        assert header == 'es;dur=12.1;desc="3 calls", total;dur=48.2'
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('wikiprox-contents'))
+        assert 'total;dur=' in response['Server-Timing']
+
+
+class URLTemplate(TestCase):
+
+    def test_url_template(self):
+        page_url = api.url_template('wikiprox-api-page')
+        for title in ['Ansel Adams', 'Nisei/Kibei?', 'Sōgō & 100%']:
+            assert page_url(title) == reverse('wikiprox-api-page', args=[title])
 
 
 class WikiPageTitles(TestCase):
@@ -132,3 +612,21 @@ class WikiPageTitles(TestCase):
         assert 'Brian Niiya' in content
         assert 'is the content director' in content
         assert '<a href="/A.L.%20Wirin/">A.L. Wirin</a>' in content
+
+
+class RewriteLinks(TestCase):
+    """Test internal link rewriting in article bodies
+    """
+
+    def test_encyc_links(self):
+        assert links.rewrite_links(
+            '<p><a class="encyc" href="/wiki/Ansel Adams">Ansel Adams</a></p>'
+        ) == '<p><a class="encyc" href="/Ansel Adams/">Ansel Adams</a></p>'
+        assert links.rewrite_links(
+            "<a href='/wiki/Manzanar/' class='new encyc'>"
+        ) == "<a href='/Manzanar/' class='new encyc'>"
+
+    def test_other_links_untouched(self):
+        html = '<a class="external" href="http://example.com/wiki/x">' \
+            '<!-- <a class="encyc" href="/wiki/Manzanar"> -->'
+        assert links.rewrite_links(html) == html
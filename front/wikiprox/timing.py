@@ -0,0 +1,188 @@
+"""wikiprox.timing -- Time spent per phase of a request
+
+Code that talks to a backend marks the time it spends:
+
+    @timing.timed('es')
+    def get(title):
+
+    with timing.phase('ddr', calls=len(terms)):
+        ...
+
+TimingMiddleware adds up the time and number of calls per phase for
+each request and reports them in a Server-Timing header
+
+    Server-Timing: es;dur=12.1;desc="3 calls", cache;dur=0.9;desc="7 calls", total;dur=48.2
+
+and a log line (logger 'wikiprox.timing', level INFO)
+
+    GET /Ansel%20Adams/ 200 total=48.2 es=12.1/3 cache=0.9/7
+
+Phases are:
+    es        Elasticsearch (Page/Author/Source get, get_light, mget)
+    ddr       Waiting for DDR API term requests (ddr.related_by_topic)
+    cache     Django cache (TimedRedisCache, see CACHE_METHODS)
+    prepare   Page.prepare
+    events    Loading the timeline events (events.backend.events_index)
+    fragment  Template tag fragments (wikiprox.fragments)
+    template  Rendering templates (TimedTemplates)
+Phases overlap: template includes any ES, cache, or fragment time spent
+while rendering, and prepare includes its cache lookups.
+
+Time is only counted on the thread handling the request.
+"""
+from contextlib import contextmanager
+from functools import wraps
+import logging
+logger = logging.getLogger(__name__)
+import threading
+import time
+
+from django.core.cache.backends.redis import RedisCache
+from django.template.backends.django import DjangoTemplates, Template
+from django.utils.deprecation import MiddlewareMixin
+
+_local = threading.local()
+
+
+def start():
+    """Start counting phases for the current thread's request
+    """
+    _local.phases = {}
+
+def stop():
+    """Stop counting and return the phases
+
+    @returns: dict {phase: [seconds, calls]} or None if not started
+    """
+    phases = getattr(_local, 'phases', None)
+    _local.phases = None
+    return phases
+
+def add(name, seconds, calls=1):
+    """Add time to a phase of the current request (if any)
+
+    @param name: str
+    @param seconds: float
+    @param calls: int
+    """
+    phases = getattr(_local, 'phases', None)
+    if phases is None:
+        return
+    if name not in phases:
+        phases[name] = [0.0, 0]
+    phases[name][0] += seconds
+    phases[name][1] += calls
+
+@contextmanager
+def phase(name, calls=1):
+    """Count the time spent in a with block
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add(name, time.perf_counter() - started, calls)
+
+def timed(name):
+    """Decorator counting the time spent in a function
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def server_timing(phases, total):
+    """Server-Timing header value
+
+    @param phases: dict {phase: [seconds, calls]}
+    @param total: float Seconds
+    @returns: str
+    """
+    metrics = [
+        '%s;dur=%.1f;desc="%s calls"' % (name, seconds * 1000, calls)
+        for name,(seconds,calls) in sorted(phases.items())
+    ]
+    metrics.append('total;dur=%.1f' % (total * 1000))
+    return ', '.join(metrics)
+
+
+class TimingMiddleware(MiddlewareMixin):
+    """Report phase timings in a Server-Timing header and the log
+
+    Put first in MIDDLEWARE so the total includes the other middleware.
+    """
+
+    def process_request(self, request):
+        request._timing_started = time.perf_counter()
+        start()
+
+    def process_response(self, request, response):
+        started = getattr(request, '_timing_started', None)
+        phases = stop()
+        if (started is None) or (phases is None):
+            return response
+        total = time.perf_counter() - started
+        response['Server-Timing'] = server_timing(phases, total)
+        logger.info('%s %s %s total=%.1f %s' % (
+            request.method, request.get_full_path(), response.status_code,
+            total * 1000,
+            ' '.join([
+                '%s=%.1f/%s' % (name, seconds * 1000, calls)
+                for name,(seconds,calls) in sorted(phases.items())
+            ])
+        ))
+        return response
+
+
+# Django cache API methods counted by TimedRedisCache
+CACHE_METHODS = [
+    'get', 'get_many', 'get_or_set', 'has_key',
+    'set', 'set_many', 'add', 'touch',
+    'incr', 'decr', 'delete', 'delete_many', 'clear',
+]
+
+def _timed_cache_method(name):
+    def method(self, *args, **kwargs):
+        call = getattr(super(TimedRedisCache, self), name)
+        # e.g. get_or_set calls get and add: count the outermost call only
+        if getattr(_local, 'in_cache', False):
+            return call(*args, **kwargs)
+        _local.in_cache = True
+        try:
+            with phase('cache'):
+                return call(*args, **kwargs)
+        finally:
+            _local.in_cache = False
+    method.__name__ = name
+    return method
+
+
+class TimedRedisCache(RedisCache):
+    """RedisCache that counts its time in phase 'cache'
+
+    Every method in CACHE_METHODS is counted.
+    """
+
+for _name in CACHE_METHODS:
+    setattr(TimedRedisCache, _name, _timed_cache_method(_name))
+
+
+class TimedTemplate(Template):
+
+    def render(self, context=None, request=None):
+        with phase('template'):
+            return super().render(context, request)
+
+
+class TimedTemplates(DjangoTemplates):
+    """DjangoTemplates that counts rendering in phase 'template'
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
@@ -8,31 +8,41 @@ from django.http import HttpResponseRedirect, HttpResponsePermanentRedirect
 from django.http import Http404
 from django.shortcuts import redirect, render
 from django.urls import reverse
-from django.views.decorators.http import require_http_methods
+from django.views.decorators.http import condition, require_http_methods
 
+from wikiprox import conditional
 from wikiprox import ddr
 from wikiprox import models
+from wikiprox import pagecache
 
 
 @require_http_methods(['GET',])
 def index(request, template_name='front/index.html'):
     return render(request, template_name, {})
 
+@pagecache.tagged('page')
 def categories(request, template_name='wikiprox/categories.html'):
     return render(request, template_name, {
         'articles_by_category': models.Page.pages_by_category(),
     })
 
+@pagecache.tagged('page')
 def contents(request, template_name='wikiprox/contents.html'):
     return render(request,  template_name, {
         'articles_by_initial': models.Page.pages_by_initial(),
     })
 
+@pagecache.tagged('author')
 def authors(request, template_name='wikiprox/authors.html'):
     return render(request, template_name, {
         'authors': models.columnizer(models.Author.authors(), 4),
     })
 
+@pagecache.tagged('author', 'url_title')
+@condition(
+    etag_func=conditional.author_etag,
+    last_modified_func=conditional.author_last_modified,
+)
 def author(request, url_title, template_name='wikiprox/author.html'):
     try:
         author = models.Author.get(url_title)
@@ -47,6 +57,9 @@ def wiki_article(request, url_title):
         reverse('wikiprox-page', args=([url_title]))
     )
 
+# Articles rendered without their DDR objects are cached this long
+DDR_ERROR_CACHE_SECONDS = 60
+
 NON_ARTICLE_PAGES = [
     'categories',
     'contents',
@@ -61,6 +74,11 @@ NON_ARTICLE_PAGES = [
     'about/editorsmessage/embed',
 ]
 
+@pagecache.tagged('page', 'url_title')
+@condition(
+    etag_func=conditional.page_etag,
+    last_modified_func=conditional.page_last_modified,
+)
 @require_http_methods(['GET',])
 def article(request, url_title='index', printed=False, template_name='wikiprox/page.html'):
     """
@@ -116,25 +134,36 @@ def article(request, url_title='index', printed=False, template_name='wikiprox/p
     )
     ddr_objects_width = 280
     ddr_img_width = ddr_objects_width / (PAGE_OBJECTS / 2)
-    return render(request, template_name, {
+    response = render(request, template_name, {
         'page': page,
         'ddr_error': ddr_error,
         'ddr_objects': ddr_objects,
         'ddr_objects_width': ddr_objects_width,
         'ddr_img_width': ddr_img_width,
     })
-
+    if ddr_error:
+        # try DDR again soon
+        pagecache.expire(response, DDR_ERROR_CACHE_SECONDS)
+    return response
+
+@pagecache.tagged('source', 'encyclopedia_id')
+@condition(
+    etag_func=conditional.source_etag,
+    last_modified_func=conditional.source_last_modified,
+)
 @require_http_methods(['GET',])
 def source(request, encyclopedia_id, template_name='wikiprox/source.html'):
     try:
         source = models.Source.get(encyclopedia_id)
     except models.NotFoundError:
         raise Http404
+    referer = False
     try:
         article_url = source.article().absolute_url()
     except AttributeError:
         article_url = request.META.get('HTTP_REFERER')
-    return render(request, template_name, {
+        referer = True
+    response = render(request, template_name, {
         'source': source,
         'article_url': article_url,
         # TODO this belongs in model
@@ -147,11 +176,15 @@ def source(request, encyclopedia_id, template_name='wikiprox/source.html'):
         'MEDIA_URL': settings.MEDIA_URL,
         'SOURCES_MEDIA_URL': settings.SOURCES_MEDIA_URL,
     })
+    if referer:
+        # differs per visitor
+        pagecache.expire(response, 0)
+    return response
 
 @require_http_methods(['GET',])
 def page_cite(request, url_title, template_name='wikiprox/cite.html'):
     try:
-        page = models.Page.get(url_title)
+        page = models.Page.get_light(url_title)
     except models.NotFoundError:
         raise Http404
     if (not page.published) and (not settings.MEDIAWIKI_SHOW_UNPUBLISHED):
@@ -164,7 +197,7 @@ def page_cite(request, url_title, template_name='wikiprox/cite.html'):
 @require_http_methods(['GET',])
 def source_cite(request, encyclopedia_id, template_name='wikiprox/cite.html'):
     try:
-        source = models.Source.get(encyclopedia_id)
+        source = models.Source.get_light(encyclopedia_id)
     except models.NotFoundError:
         raise Http404
     citation = models.Citation(source, request)
@@ -177,7 +210,7 @@ def related_ddr(request, url_title='index', template_name='wikiprox/related-ddr.
     """List of topic terms and DDR objects relating to page
     """
     try:
-        page = models.Page.get(url_title)
+        page = models.Page.get_light(url_title)
     except models.NotFoundError:
         raise Http404
     # show small number of objects, distributed among topics